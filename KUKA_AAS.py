@@ -1,19 +1,19 @@
 import threading
 import time
 import random
-from db_setup import get_connection
-from data_logic import ensure_aas_structure_kuka, store_data_point_kuka
+from db_setup import connection
+from data_logic import ensure_aas_structure_kuka, store_data_point_kuka, is_provisioned
 from config import KUKA_SUBMODEL_TEMPLATE
 
 stop_threads = False
 
-def generate_kuka_data():
+def generate_kuka_data(serial_number="SN-KUKA1234", robot_name="KUKA-ARM-01"):
     """
     Generates simulated data for a KUKA robotic arm.
     """
     return {
-        "serial_number": "SN-KUKA1234",
-        "robot_name": "KUKA-ARM-01",
+        "serial_number": serial_number,
+        "robot_name": robot_name,
         "battery_state": random.choice(["Charging", "Discharging", "Full"]),
         "robot_runtime": random.randint(0, 10000),
         "velocity": round(random.uniform(0, 2), 2),
@@ -29,27 +29,36 @@ def generate_kuka_data():
         "program_state": random.choice(["Running", "Paused", "Completed"])
     }
 
-def process_kuka_data():
+def process_kuka_data(writer=None, serial_number="SN-KUKA1234", robot_name="KUKA-ARM-01", spool=None):
     """
     Collects and stores KUKA data in the AAS database.
+    With a BatchWriter the data point is queued for its next flush; with a
+    Spool it is only appended to local disk and stored by the spool's drainer.
     """
-    conn = get_connection()
-    try:
-        # Generate data
-        data = generate_kuka_data()
+    # Generate data
+    data = generate_kuka_data(serial_number, robot_name)
+
+    # The spool does not need the database
+    if spool is not None:
+        spool.append("kuka", data)
+        return
 
-        # Ensure AAS structure exists
-        ensure_aas_structure_kuka(conn, data)
+    # Provision the AAS structure once per robot (and template change)
+    if not is_provisioned(serial_number, KUKA_SUBMODEL_TEMPLATE):
+        with connection() as conn:
+            ensure_aas_structure_kuka(conn, data)
 
-        # Store the data point
-        store_data_point_kuka(conn, data)
-    finally:
-        conn.close()
+    # Store the data point
+    if writer is not None:
+        writer.submit(data, KUKA_SUBMODEL_TEMPLATE)
+    else:
+        with connection() as conn:
+            store_data_point_kuka(conn, data)
 
-def kuka_thread():
+def kuka_thread(writer=None):
     global stop_threads
     while not stop_threads:
-        process_kuka_data()
+        process_kuka_data(writer)
         time.sleep(2)
 
 if __name__ == "__main__":
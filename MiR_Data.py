@@ -1,19 +1,19 @@
 import threading
 import time
 import random
-from db_setup import get_connection
-from data_logic import ensure_aas_structure_mir, store_data_point_mir
+from db_setup import connection
+from data_logic import ensure_aas_structure_mir, store_data_point_mir, is_provisioned
 from config import MIR_SUBMODEL_TEMPLATE
 
 stop_threads = False
 
-def generate_mir_data():
+def generate_mir_data(serial_number="SN-MIR1234", robot_name="MiR-100"):
     """
     Generates simulated data for a MiR robot.
     """
     return {
-        "serial_number": "SN-MIR1234",
-        "robot_name": "MiR-100",
+        "serial_number": serial_number,
+        "robot_name": robot_name,
         "mode_text": "Operational",
         "state_text": "Active",
         "battery_percentage": round(random.uniform(0, 100), 2),
@@ -32,27 +32,39 @@ def generate_mir_data():
         "unloadedMapChanges": random.randint(0, 5)
     }
 
-def process_mir_data():
+def process_mir_data(writer=None, serial_number="SN-MIR1234", robot_name="MiR-100", spool=None, data=None):
     """
     Collects and stores MiR data in the AAS database.
+    With a BatchWriter the data point is queued for its next flush; with a
+    Spool it is only appended to local disk and stored by the spool's drainer.
+    `data` is a data point already fetched from the robot (mir_poller.py);
+    without it one is simulated.
     """
-    conn = get_connection()
-    try:
-        # Generate data
-        data = generate_mir_data()
+    # Generate data
+    if data is None:
+        data = generate_mir_data(serial_number, robot_name)
+
+    # The spool does not need the database
+    if spool is not None:
+        spool.append("mir", data)
+        return
 
-        # Ensure AAS structure exists
-        ensure_aas_structure_mir(conn, data)
+    # Provision the AAS structure once per robot (and template change)
+    if not is_provisioned(serial_number, MIR_SUBMODEL_TEMPLATE):
+        with connection() as conn:
+            ensure_aas_structure_mir(conn, data)
 
-        # Store the data point
-        store_data_point_mir(conn, data)
-    finally:
-        conn.close()
+    # Store the data point
+    if writer is not None:
+        writer.submit(data, MIR_SUBMODEL_TEMPLATE)
+    else:
+        with connection() as conn:
+            store_data_point_mir(conn, data)
 
-def mir_thread():
+def mir_thread(writer=None):
     global stop_threads
     while not stop_threads:
-        process_mir_data()
+        process_mir_data(writer)
         time.sleep(2)
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+# bench_ingest.py
+#
+# Measures how many samples/s the ingest path sustains against a throwaway
+# local Postgres database:
+#
+#   python bench_ingest.py --robots 20 --history-rows 1000000 --samples 5000 --rate 200
+#
+# The database is created on the server from config.py, seeded, driven through
+# data_logic and dropped again (unless --keep-db). Results are written as JSON so
+# runs from different commits can be compared.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta
+import psycopg2
+from psycopg2 import extensions
+from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE
+from migrations import migrate
+from partitions import ensure_partitions
+from data_logic import ensure_aas_structure_mir, ensure_aas_structure_kuka
+from data_logic import store_data_point_mir, store_data_point_kuka, store_samples, HISTORY_TABLE, HISTORY_LAYOUT
+from MiR_Data import generate_mir_data
+from KUKA_AAS import generate_kuka_data
+
+BENCH_TABLES = ["aas", "submodel", "submodel_element", "submodel_element_history", "submodel_sample_history",
+                "history_rollup_1m", "history_rollup_1h"]
+
+ROBOT_TYPES = {
+    "mir": (generate_mir_data, ensure_aas_structure_mir, store_data_point_mir, MIR_SUBMODEL_TEMPLATE),
+    "kuka": (generate_kuka_data, ensure_aas_structure_kuka, store_data_point_kuka, KUKA_SUBMODEL_TEMPLATE),
+}
+
+
+class CountingCursor(extensions.cursor):
+    """
+    Cursor that counts the statements sent through it.
+    """
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingCursor.statements += 1
+        return super().executemany(query, vars_list)
+
+
+def connect(dbname, **kwargs):
+    return psycopg2.connect(dbname=dbname, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, **kwargs)
+
+
+def create_database(dbname):
+    admin = connect("postgres")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+        cur.execute(f'CREATE DATABASE "{dbname}"')
+    admin.close()
+
+
+def drop_database(dbname):
+    admin = connect("postgres")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+    admin.close()
+
+
+def make_robots(count, robot_type):
+    """
+    Returns (type, data generator) pairs for `count` robots with distinct serial numbers.
+    """
+    types = ["mir", "kuka"] if robot_type == "mixed" else [robot_type]
+    robots = []
+    for i in range(count):
+        kind = types[i % len(types)]
+        generate = ROBOT_TYPES[kind][0]
+
+        def generate_robot_data(generate=generate, kind=kind, i=i):
+            data = generate()
+            data["serial_number"] = f"BENCH-{kind.upper()}-{i:05d}"
+            data["robot_name"] = f"bench-{kind}-{i}"
+            return data
+
+        robots.append((kind, generate_robot_data))
+    return robots
+
+
+def seed_history(conn, robots, rows, chunk_samples=500):
+    """
+    Backfills roughly `rows` element values of history (rows of the narrow
+    layout), spread 2 s apart per robot before now.
+    """
+    per_sample = {kind: sum(len(keys) for keys in ROBOT_TYPES[kind][3].values()) for kind in ROBOT_TYPES}
+    written = 0
+    step = 0
+    now = datetime.now()
+    batch = []
+    while written < rows:
+        step += 1
+        for kind, generate in robots:
+            batch.append((generate(), ROBOT_TYPES[kind][3], now - timedelta(seconds=2 * step)))
+            written += per_sample[kind]
+            if written >= rows:
+                break
+        if len(batch) >= chunk_samples:
+            _store_backdated(conn, batch)
+            batch = []
+    if batch:
+        _store_backdated(conn, batch)
+    return written
+
+
+def _store_backdated(conn, batch):
+    # Backdated rows need partitions that maintenance would not create
+    with conn.cursor() as cur:
+        ensure_partitions(cur, HISTORY_TABLE, start=min(recorded_at for _, _, recorded_at in batch))
+    conn.commit()
+    store_samples(conn, batch)
+
+
+def table_sizes(conn):
+    """
+    Returns row estimates and heap/index sizes per table, summed over partitions.
+    """
+    sizes = {}
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+        for table in BENCH_TABLES:
+            cur.execute("""
+                SELECT COALESCE(SUM(c.reltuples), 0)::bigint,
+                       COALESCE(SUM(pg_table_size(t.relid)), 0)::bigint,
+                       COALESCE(SUM(pg_indexes_size(t.relid)), 0)::bigint
+                FROM pg_partition_tree(%s::regclass) t
+                JOIN pg_class c ON c.oid = t.relid
+                WHERE t.isleaf
+            """, (table,))
+            est_rows, table_bytes, index_bytes = cur.fetchone()
+            sizes[table] = {"rows": est_rows, "table_bytes": table_bytes, "index_bytes": index_bytes}
+    conn.commit()
+    return sizes
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": pick(50),
+        "p90": pick(90),
+        "p99": pick(99),
+        "max": ordered[-1],
+    }
+
+
+def drive(conn, robots, samples, rate, batch_size, with_ensure):
+    """
+    Feeds `samples` data points round-robin through the ingest functions at
+    `rate` samples/s (0 = as fast as possible) and times every call.
+    """
+    ensure_ms, store_ms = [], []
+    start_statements = CountingCursor.statements
+    started = time.perf_counter()
+    batch = []
+
+    for i in range(samples):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        kind, generate = robots[i % len(robots)]
+        _, ensure, store, template = ROBOT_TYPES[kind]
+        data = generate()
+
+        if with_ensure:
+            t0 = time.perf_counter()
+            ensure(conn, data)
+            ensure_ms.append((time.perf_counter() - t0) * 1000)
+
+        if batch_size > 1:
+            batch.append((data, template, None))
+            if len(batch) < batch_size and i < samples - 1:
+                continue
+            t0 = time.perf_counter()
+            store_samples(conn, batch)
+            # Spread the batch's latency over the samples it carried
+            store_ms.extend([(time.perf_counter() - t0) * 1000 / len(batch)] * len(batch))
+            batch = []
+        else:
+            t0 = time.perf_counter()
+            store(conn, data)
+            store_ms.append((time.perf_counter() - t0) * 1000)
+
+    elapsed = time.perf_counter() - started
+    total_ms = [s + e for s, e in zip(store_ms, ensure_ms)] if with_ensure else store_ms
+    return {
+        "samples": samples,
+        "elapsed_s": elapsed,
+        "samples_per_s": samples / elapsed if elapsed else None,
+        "statements_per_sample": (CountingCursor.statements - start_statements) / samples,
+        "latency_ms": {
+            "total": percentiles(total_ms),
+            "ensure": percentiles(ensure_ms),
+            "store": percentiles(store_ms),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AAS ingest throughput against a throwaway database.")
+    parser.add_argument("--robots", type=int, default=10, help="number of simulated robots")
+    parser.add_argument("--robot-type", choices=["mir", "kuka", "mixed"], default="mixed")
+    parser.add_argument("--history-rows", type=int, default=0, help="history rows to seed before measuring")
+    parser.add_argument("--samples", type=int, default=2000, help="samples to ingest while measuring")
+    parser.add_argument("--rate", type=float, default=0, help="target samples/s, 0 for unthrottled")
+    parser.add_argument("--batch-size", type=int, default=1, help="samples per store_samples call, 1 uses store_data_point_*")
+    parser.add_argument("--no-ensure", action="store_true", help="skip the per-cycle ensure_aas_structure_* call")
+    parser.add_argument("--dbname", default=f"aas_bench_{os.getpid()}")
+    parser.add_argument("--keep-db", action="store_true", help="do not drop the benchmark database afterwards")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    create_database(args.dbname)
+    try:
+        conn = connect(args.dbname, cursor_factory=CountingCursor)
+        try:
+            migrate(conn)
+            robots = make_robots(args.robots, args.robot_type)
+            for kind, generate in robots:
+                ROBOT_TYPES[kind][1](conn, generate())
+
+            seed_started = time.perf_counter()
+            seeded = seed_history(conn, robots, args.history_rows) if args.history_rows else 0
+            seed_elapsed = time.perf_counter() - seed_started
+
+            before = table_sizes(conn)
+            results = drive(conn, robots, args.samples, args.rate, args.batch_size, not args.no_ensure)
+            after = table_sizes(conn)
+        finally:
+            conn.close()
+    finally:
+        if not args.keep_db:
+            drop_database(args.dbname)
+
+    results["tables"] = {
+        table: {
+            "before": before[table],
+            "after": after[table],
+            "growth_bytes": (after[table]["table_bytes"] + after[table]["index_bytes"])
+                            - (before[table]["table_bytes"] + before[table]["index_bytes"]),
+        }
+        for table in BENCH_TABLES
+    }
+    report = {
+        "commit": git_commit(),
+        "run_at": datetime.now().isoformat(),
+        "params": vars(args),
+        "history_layout": HISTORY_LAYOUT,
+        "seeded_history_rows": seeded,
+        "seed_elapsed_s": seed_elapsed,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = results["latency_ms"]["total"]
+    print(f"{results['samples_per_s']:.1f} samples/s, "
+          f"p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, "
+          f"{results['statements_per_sample']:.1f} statements/sample -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# change_feed.py
+#
+# Tells other processes what the ingest path just stored. data_logic publishes
+# change events with pg_notify inside its write transaction, so they are only
+# delivered once the data is committed; a ChangeListener in the API process
+# LISTENs for them and hands them to local subscribers (caches, streams, ...).
+
+import json
+import select
+import threading
+import psycopg2
+from psycopg2 import extensions
+from config import CHANGE_CHANNEL
+
+
+# NOTIFY payloads must stay below 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+
+def publish(cur, events):
+    """
+    Queues change events for delivery on commit.
+
+    An event is a JSON-serializable dict with "aas_id" and, for stored data,
+    "recorded_at" and "values" ({submodel title: {key: value}}); the last event
+    of an AAS in a commit also has its "version", "updated_at" and
+    "submodel_versions" ({title: [version, updated_at]}). Events too
+    big for a notification are sent without their values and marked
+    "truncated", so listeners know to re-read that AAS.
+    """
+    payloads = []
+    for event in events:
+        payload = json.dumps(event, default=str)
+        if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+            payload = json.dumps({"aas_id": event["aas_id"], "truncated": True})
+        payloads.append(payload)
+    if payloads:
+        cur.execute(
+            "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+            (CHANGE_CHANNEL, payloads)
+        )
+
+
+class ChangeListener:
+    """
+    Background thread that LISTENs on the change channel and calls subscribers.
+
+    `on_change(event)` is called for every event; `on_reset()` after the
+    listening connection was (re)established, since events may have been
+    missed while it was down. Subscribers run on the listener thread and
+    must be quick.
+    """
+
+    def __init__(self, connect, channel=CHANGE_CHANNEL, poll_timeout=5.0, retry_delay=2.0):
+        self._connect = connect
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, on_change, on_reset=None):
+        with self._lock:
+            self._subscribers.append((on_change, on_reset))
+
+    def is_listening(self):
+        """
+        True while events are being received; consumers should not trust cached state otherwise.
+        """
+        return self._listening.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                self._listening.set()
+                self._dispatch_reset()
+
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            event = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        self._dispatch(event)
+            except (psycopg2.Error, OSError) as e:
+                print(f"Change listener disconnected: {e}")
+            finally:
+                self._listening.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+            self._stopped.wait(self.retry_delay)
+
+    def _dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for on_change, _ in subscribers:
+            try:
+                on_change(event)
+            except Exception as e:
+                print(f"Change subscriber failed: {e}")
+
+    def _dispatch_reset(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for _, on_reset in subscribers:
+            if on_reset is not None:
+                try:
+                    on_reset()
+                except Exception as e:
+                    print(f"Change subscriber failed: {e}")
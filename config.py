@@ -6,53 +6,216 @@ DB_PASSWORD = "omnifactory1234"
 DB_HOST = "localhost"
 DB_PORT = 5432
 
-# Template of submodel names and their keys for MiRs
+# Shared connection pool: open connections kept/allowed, seconds a borrower
+# waits for a free connection, and idle seconds after which a connection is
+# checked with SELECT 1 before reuse
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+DB_POOL_TIMEOUT = 5.0
+DB_POOL_HEALTHCHECK_INTERVAL = 30.0
+
+# Batched ingest: seconds between flushes, samples that force an early flush,
+# and how many unwritten samples to keep while the database is unavailable
+BATCH_FLUSH_INTERVAL = 5.0
+BATCH_MAX_SAMPLES = 500
+BATCH_MAX_PENDING = 50000
+
+# Channel on which the ingest path announces stored data (LISTEN/NOTIFY)
+CHANGE_CHANNEL = "aas_changes"
+
+# Write-ahead spool: run-all.py appends samples to segment files in this
+# directory and a drainer stores them (None writes through BatchWriter instead).
+# Bytes per segment, undrained bytes kept before the oldest segments are
+# dropped, seconds between fsyncs, samples per drained transaction and seconds
+# the drainer waits when it is caught up or the database failed
+INGEST_SPOOL_DIR = "spool"
+SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+SPOOL_MAX_BYTES = 1024 * 1024 * 1024
+SPOOL_FSYNC_INTERVAL = 0.2
+SPOOL_DRAIN_MAX_SAMPLES = 500
+SPOOL_DRAIN_INTERVAL = 1.0
+
+# HTTP ingest (POST /aas/ingest): most samples per request, and seconds a
+# robot timestamp may lie ahead of the server clock
+INGEST_MAX_SAMPLES = 5000
+INGEST_MAX_CLOCK_SKEW = 300
+
+# Instrumentation: counters and latency histograms served on /metrics (and by
+# run-all.py on METRICS_PORT, None to not serve them); bucket bounds in seconds
+METRICS_ENABLED = True
+METRICS_PORT = 9108
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Robots polled by run-all.py: type ("mir" or "kuka"), identity and seconds between
+# polls. MiR robots with a "url" are polled over their REST API (mir_poller.py),
+# the others are simulated
+ROBOTS = [
+    {"type": "mir", "serial_number": "SN-MIR1234", "robot_name": "MiR-100", "interval": 2.0},
+    {"type": "kuka", "serial_number": "SN-KUKA1234", "robot_name": "KUKA-ARM-01", "interval": 2.0},
+]
+
+# Robots polled at the same time by the scheduler: blocking polls (keep at or
+# below DB_POOL_MAX_SIZE) and network polls awaited on the event loop
+SCHEDULER_MAX_CONCURRENCY = 8
+SCHEDULER_MAX_ASYNC_CONCURRENCY = 512
+
+# MiR REST polling (mir_poller.py): value of the Authorization header sent to
+# the robots (None: none), seconds a status request may take and HTTP
+# connections kept open across all robots (one keep-alive connection each)
+MIR_API_AUTHORIZATION = None
+MIR_POLL_TIMEOUT = 1.5
+MIR_POLL_MAX_CONNECTIONS = 512
+
+# Live value stream (/stream): events queued per client before the oldest are
+# dropped, concurrent clients allowed and seconds between keep-alive comments
+LIVE_STREAM_QUEUE_SIZE = 256
+LIVE_STREAM_MAX_CLIENTS = 100
+LIVE_STREAM_HEARTBEAT = 15
+
+# Element history API: rows per page by default and at most, the largest
+# number of points a downsampled response may ask for, and rows read from the
+# server-side cursor per chunk of a streamed (stream=json/ndjson) response
+HISTORY_DEFAULT_LIMIT = 1000
+HISTORY_MAX_LIMIT = 10000
+HISTORY_MAX_POINTS = 5000
+HISTORY_STREAM_CHUNK_ROWS = 2000
+
+# Aggregation API: seconds covered when no range is given, and the most
+# buckets one request may produce
+AGGREGATE_DEFAULT_RANGE = 86400
+AGGREGATE_MAX_BUCKETS = 10000
+
+# History export (export.py, /aas/export): rows fetched from the server-side
+# cursor and written per batch
+EXPORT_BATCH_ROWS = 50000
+
+# History storage layout: "narrow" stores one submodel_element_history row per
+# element and sample, "wide" one submodel_sample_history row per submodel and
+# sample with the values as JSONB. Reads work on either; convert existing
+# history with `python history_layout.py convert --to wide` after switching
+HISTORY_LAYOUT = "narrow"
+
+# History partitioning: "daily" or "weekly" partitions, how many are created
+# ahead of time, days of history kept (None keeps everything) and seconds
+# between maintenance runs
+HISTORY_PARTITION_INTERVAL = "daily"
+HISTORY_PARTITION_PREMAKE = 7
+HISTORY_RETENTION_DAYS = 90
+PARTITION_MAINTENANCE_INTERVAL = 3600
+
+# History rollups (rollups.py): days of per-minute and per-hour rollups kept
+# (None keeps everything); they usually outlive HISTORY_RETENTION_DAYS
+ROLLUP_RETENTION_DAYS = 400
+
+# Value types an element can declare; they select the history column a value is stored in:
+#   "float"/"integer" -> value_num (float8), "boolean" -> value_bool,
+#   "json" -> value_json (JSONB), "string" -> value (TEXT)
+VALUE_TYPES = ("string", "integer", "float", "boolean", "json")
+
+# Template of submodel names and their keys (with value types) for MiRs
 MIR_SUBMODEL_TEMPLATE = {
-    "OperationalData": [
-        "mode_text",
-        "state_text",
-        "battery_percentage",
-        "battery_time_remaining",
-        "velocity",
-        "velocityAngular"
-    ],
-    "NavigationAndMission": [
-        "mission_queue_id",
-        "mission_text",
-        "moved",
-        "distance_to_next_target",
-        "positionX",
-        "positionY",
-        "orientation"
-    ],
-    "ConfigurationAndSettings": [
-        "joystick_low_speed_mode_enabled",
-        "safety_system_muted",
-        "unloadedMapChanges"
-    ]
+    "OperationalData": {
+        "mode_text": "string",
+        "state_text": "string",
+        "battery_percentage": "float",
+        "battery_time_remaining": "integer",
+        "velocity": "float",
+        "velocityAngular": "float"
+    },
+    "NavigationAndMission": {
+        "mission_queue_id": "integer",
+        "mission_text": "string",
+        "moved": "float",
+        "distance_to_next_target": "float",
+        "positionX": "float",
+        "positionY": "float",
+        "orientation": "float"
+    },
+    "ConfigurationAndSettings": {
+        "joystick_low_speed_mode_enabled": "boolean",
+        "safety_system_muted": "boolean",
+        "unloadedMapChanges": "integer"
+    }
 }
 
-# Template of submodel names and their keys for KUKA robots
+# Template of submodel names and their keys (with value types) for KUKA robots
 KUKA_SUBMODEL_TEMPLATE = {
-    "Operational_Data": [
-        "battery_state",
-        "robot_runtime",
-        "velocity",
-        "acceleration",
-        "load"
-    ],
-    "Navigation_Data": [
-        "position",
-        "tool_status",
-        "orientation"
-    ],
-    "Mission_Data": [
-        "number_of_missions",
-        "timer"
-    ],
-    "Process_Data": [
-        "motion_state",
-        "distance_to_next",
-        "program_state"
-    ]
+    "Operational_Data": {
+        "battery_state": "string",
+        "robot_runtime": "integer",
+        "velocity": "float",
+        "acceleration": "float",
+        "load": "float"
+    },
+    "Navigation_Data": {
+        "position": "string",
+        "tool_status": "string",
+        "orientation": "string"
+    },
+    "Mission_Data": {
+        "number_of_missions": "integer",
+        "timer": "string"
+    },
+    "Process_Data": {
+        "motion_state": "string",
+        "distance_to_next": "float",
+        "program_state": "string"
+    }
+}
+
+# History recording policies per submodel and key, declared next to the templates.
+# Keys that are not listed get a history row on every sample. A policy has a
+# "mode" and an optional "max_silence":
+#   "always"     record every sample
+#   "on_change"  record only when the value differs from the last recorded one
+#   "deadband"   numerics only: record when the value moved by more than
+#                "absolute" units or "percent" % of the last recorded value
+#                (non-numeric values fall back to on_change)
+#   max_silence  heartbeat: record anyway once this many seconds passed since
+#                the last recorded row
+# The last recorded row is re-read from the history table before every batch;
+# the policies still assume one writer per robot at a time.
+MIR_RECORDING_POLICY = {
+    "OperationalData": {
+        "mode_text": {"mode": "on_change", "max_silence": 300},
+        "state_text": {"mode": "on_change", "max_silence": 300},
+        "battery_percentage": {"mode": "deadband", "absolute": 0.5, "max_silence": 60},
+        "battery_time_remaining": {"mode": "deadband", "absolute": 1, "max_silence": 60},
+        "velocity": {"mode": "deadband", "absolute": 0.01, "max_silence": 60},
+        "velocityAngular": {"mode": "deadband", "absolute": 0.01, "max_silence": 60}
+    },
+    "NavigationAndMission": {
+        "mission_queue_id": {"mode": "on_change", "max_silence": 300},
+        "mission_text": {"mode": "on_change", "max_silence": 300},
+        "moved": {"mode": "deadband", "absolute": 0.1, "max_silence": 60},
+        "distance_to_next_target": {"mode": "deadband", "absolute": 0.05, "max_silence": 60},
+        "positionX": {"mode": "deadband", "absolute": 0.05, "max_silence": 60},
+        "positionY": {"mode": "deadband", "absolute": 0.05, "max_silence": 60},
+        "orientation": {"mode": "deadband", "absolute": 0.5, "max_silence": 60}
+    },
+    "ConfigurationAndSettings": {
+        "joystick_low_speed_mode_enabled": {"mode": "on_change", "max_silence": 300},
+        "safety_system_muted": {"mode": "on_change", "max_silence": 300},
+        "unloadedMapChanges": {"mode": "on_change", "max_silence": 300}
+    }
+}
+
+KUKA_RECORDING_POLICY = {
+    "Operational_Data": {
+        "battery_state": {"mode": "on_change", "max_silence": 300},
+        "velocity": {"mode": "deadband", "percent": 1, "max_silence": 60},
+        "acceleration": {"mode": "deadband", "percent": 1, "max_silence": 60},
+        "load": {"mode": "deadband", "percent": 1, "max_silence": 60}
+    },
+    "Navigation_Data": {
+        "tool_status": {"mode": "on_change", "max_silence": 300}
+    },
+    "Mission_Data": {
+        "number_of_missions": {"mode": "on_change", "max_silence": 300}
+    },
+    "Process_Data": {
+        "motion_state": {"mode": "on_change", "max_silence": 300},
+        "distance_to_next": {"mode": "deadband", "absolute": 0.05, "max_silence": 60},
+        "program_state": {"mode": "on_change", "max_silence": 300}
+    }
 }
@@ -1,68 +1,460 @@
 # data_logic.py
 
+import hashlib
+import math
 import uuid
 import json
+import threading
+from datetime import datetime
+from psycopg2.extras import execute_values, Json
+from change_feed import publish
+from metrics import stage, timed, ingested_samples
 from config import MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE
+from config import MIR_RECORDING_POLICY, KUKA_RECORDING_POLICY
+from config import BATCH_FLUSH_INTERVAL, BATCH_MAX_SAMPLES, BATCH_MAX_PENDING
+from config import HISTORY_LAYOUT
+from rollups import rollup_ctes
+
+# Columns holding an element's value; exactly one is set, chosen by value_type
+VALUE_COLUMNS = "value, value_num, value_bool, value_json"
+
+# Namespace of the history row IDs derived from a sample's "sample_id"
+HISTORY_ID_NAMESPACE = uuid.UUID("6f1c2b1e-8d3a-5b7e-9c4f-2a1d0e3b5c7a")
+
+# History table of each storage layout (HISTORY_LAYOUT)
+HISTORY_TABLES = {"narrow": "submodel_element_history", "wide": "submodel_sample_history"}
+if HISTORY_LAYOUT not in HISTORY_TABLES:
+    raise ValueError(f"Unknown HISTORY_LAYOUT: {HISTORY_LAYOUT!r} (expected one of {sorted(HISTORY_TABLES)})")
+HISTORY_TABLE = HISTORY_TABLES[HISTORY_LAYOUT]
+
+# History inserts of both layouts. The rows actually inserted (replays of a
+# sample_id are not) are folded into the rollup tables in the same statement
+_NARROW_HISTORY_INSERT = f"""
+    WITH inserted AS (
+        INSERT INTO submodel_element_history (id, submodel_element_id, {VALUE_COLUMNS}, recorded_at)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING submodel_element_id, recorded_at, value_num
+    ){rollup_ctes("inserted")}
+    SELECT COUNT(*) FROM inserted
+"""
+
+_WIDE_HISTORY_INSERT = f"""
+    WITH inserted AS (
+        INSERT INTO submodel_sample_history (id, submodel_id, element_values, recorded_at)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING submodel_id, element_values, recorded_at
+    ), inserted_values AS (
+        SELECT e.id AS submodel_element_id, i.recorded_at, (i.element_values -> e.key)::float8 AS value_num
+        FROM inserted i
+        JOIN submodel_element e ON e.submodel_id = i.submodel_id
+        WHERE e.value_type <> 'json' AND jsonb_typeof(i.element_values -> e.key) = 'number'
+    ){rollup_ctes("inserted_values")}
+    SELECT COUNT(*) FROM inserted
+"""
+
+# serial_number -> {submodel title -> (submodel id, {key -> submodel_element id})}
+_structure_ids = {}
+_structure_ids_lock = threading.Lock()
+
+# serial_number -> hash of the template its structure was provisioned from
+_provisioned = {}
+
+# Creates whatever is missing of an AAS and its template in one statement;
+# %(elements)s lists (submodel_id, title, element_id, key, value_type) with
+# fresh IDs that are only used where nothing exists yet. Rows inserted by
+# the CTEs are not visible to the rest of the statement, hence the UNION.
+_PROVISION = """
+    WITH a AS (
+        INSERT INTO aas (id, name, description, robot_type)
+        VALUES (%(aas_id)s, %(name)s, %(description)s, %(robot_type)s)
+        ON CONFLICT (id) DO NOTHING
+    ), t AS (
+        SELECT * FROM jsonb_to_recordset(%(elements)s)
+            AS t(submodel_id uuid, title text, element_id uuid, key text, value_type text)
+    ), s AS (
+        INSERT INTO submodel (id, aas_id, title, semantic_id)
+        SELECT DISTINCT submodel_id, %(aas_id)s, title, 'http://omnifactory-assets.com/' || title FROM t
+        ON CONFLICT (aas_id, title) DO NOTHING
+        RETURNING id, title
+    ), sm AS (
+        SELECT id, title FROM s
+        UNION ALL
+        SELECT id, title FROM submodel WHERE aas_id = %(aas_id)s
+    ), e AS (
+        INSERT INTO submodel_element (id, submodel_id, key, value, value_type)
+        SELECT t.element_id, sm.id, t.key, NULL, t.value_type FROM t JOIN sm ON sm.title = t.title
+        ON CONFLICT (submodel_id, key) DO NOTHING
+        RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM s) + (SELECT COUNT(*) FROM e)
+"""
+
+
+def _load_structure_ids(cur, aas_id):
+    """
+    Reads the submodel/element IDs of one AAS in a single query.
+    """
+    cur.execute("""
+        SELECT s.title, s.id, e.key, e.id
+        FROM submodel s
+        JOIN submodel_element e ON e.submodel_id = s.id
+        WHERE s.aas_id = %s
+    """, (aas_id,))
+    ids = {}
+    for title, sm_id, key, elem_id in cur.fetchall():
+        ids.setdefault(title, (sm_id, {}))[1][key] = elem_id
+    return ids
+
+
+def _resolve_structure_ids(cur, aas_id):
+    """
+    Returns the cached element IDs of an AAS, loading them on first use.
+    """
+    with _structure_ids_lock:
+        ids = _structure_ids.get(aas_id)
+    if ids is None:
+        ids = _load_structure_ids(cur, aas_id)
+        with _structure_ids_lock:
+            _structure_ids[aas_id] = ids
+    return ids
+
+
+def invalidate_structure_cache(aas_id=None):
+    """
+    Drops the cached element IDs of one AAS, or of all of them, so the
+    structure is also provisioned again on the next ensure call.
+    """
+    with _structure_ids_lock:
+        if aas_id is None:
+            _structure_ids.clear()
+            _provisioned.clear()
+        else:
+            _structure_ids.pop(aas_id, None)
+            _provisioned.pop(aas_id, None)
+
+
+# Submodel titles differ between robot types, so one lookup serves all templates
+RECORDING_POLICIES = {**MIR_RECORDING_POLICY, **KUKA_RECORDING_POLICY}
+ALWAYS_RECORD = {"mode": "always"}
+
+# element id -> (value, recorded time) of the last history row, as far as this
+# process knows; refreshed from the history table before each batch is decided
+_last_recorded = {}
+_recording_state_lock = threading.Lock()
+
+# Latest history row of each listed element that is newer than the time this
+# process last knew of, i.e. one another writer added since
+_LAST_RECORDED_QUERIES = {
+    "narrow": f"""
+        SELECT l.id, e.value_type, h.value, h.value_num, h.value_bool, h.value_json, h.recorded_at
+        FROM (VALUES %s) AS l(id, after)
+        JOIN submodel_element e ON e.id = l.id
+        CROSS JOIN LATERAL (
+            SELECT {VALUE_COLUMNS}, recorded_at FROM submodel_element_history
+            WHERE submodel_element_id = l.id AND recorded_at > l.after
+            ORDER BY recorded_at DESC LIMIT 1
+        ) h
+    """,
+    "wide": """
+        SELECT l.id, h.element_values -> e.key, h.recorded_at
+        FROM (VALUES %s) AS l(id, after)
+        JOIN submodel_element e ON e.id = l.id
+        CROSS JOIN LATERAL (
+            SELECT element_values, recorded_at FROM submodel_sample_history
+            WHERE submodel_id = e.submodel_id AND element_values ? e.key AND recorded_at > l.after
+            ORDER BY recorded_at DESC LIMIT 1
+        ) h
+    """,
+}
+
+
+def _event_value(value_type, columns):
+    value, value_num, value_bool, value_json = columns
+    if isinstance(value_json, Json):
+        value_json = value_json.adapted
+    return decode_value(value_type, value, value_num, value_bool, value_json)
+
+
+def _should_record(policy, value, recorded_at, last):
+    """
+    Decides whether `value` gets a history row under a recording policy, given
+    the (value, recorded time) of the element's last history row or None.
+    """
+    if last is None or policy["mode"] == "always":
+        return True
+    last_value, last_recorded_at = last
+    max_silence = policy.get("max_silence")
+    if max_silence is not None and (recorded_at - last_recorded_at).total_seconds() >= max_silence:
+        return True
+
+    if policy["mode"] == "deadband":
+        try:
+            delta = abs(float(value) - float(last_value))
+        except (TypeError, ValueError):
+            return value != last_value
+        if "absolute" in policy and delta > policy["absolute"]:
+            return True
+        if "percent" in policy and delta > abs(float(last_value)) * policy["percent"] / 100.0:
+            return True
+        return False
+
+    # on_change
+    return value != last_value
+
+
+def _json_value(columns):
+    """
+    Returns the JSON form of encoded value columns, as kept in a wide history row.
+    """
+    value, value_num, value_bool, value_json = columns
+    if value_json is not None:
+        return value_json.adapted if isinstance(value_json, Json) else value_json
+    if value_num is not None:
+        # JSON has no NaN or infinity
+        return value_num if math.isfinite(value_num) else str(value_num)
+    if value_bool is not None:
+        return value_bool
+    return value
+
+
+def reset_recording_state():
+    """
+    Forgets the last recorded values, so they are read from the history table again.
+    """
+    with _recording_state_lock:
+        _last_recorded.clear()
+
+
+def _policy_elements(samples, structures):
+    """
+    Returns the IDs of the elements in `samples` whose keys have a recording
+    policy other than "always"; `structures` holds each sample's structure IDs.
+    """
+    elem_ids = set()
+    for (data, submodel_template, _), structure_ids in zip(samples, structures):
+        for submodel_name, keys in submodel_template.items():
+            key_to_id = structure_ids.get(submodel_name, (None, {}))[1]
+            policies = RECORDING_POLICIES.get(submodel_name, {})
+            for k in keys:
+                if k in data and k in key_to_id and policies.get(k, ALWAYS_RECORD)["mode"] != "always":
+                    elem_ids.add(key_to_id[k])
+    return elem_ids
+
+
+def _refresh_last_recorded(cur, elem_ids):
+    """
+    Returns the (value, recorded time) of the last history row of each
+    element, or None for elements without history. Known entries are only
+    checked for newer rows, so the lookup stays within recent partitions.
+    """
+    with _recording_state_lock:
+        last = {elem_id: _last_recorded.get(elem_id) for elem_id in elem_ids}
+    if not last:
+        return last
+    rows = execute_values(cur, _LAST_RECORDED_QUERIES[HISTORY_LAYOUT],
+                          [(elem_id, entry[1] if entry else None) for elem_id, entry in last.items()],
+                          template="(%s::uuid, COALESCE(%s::timestamp, '-infinity'))", page_size=len(last), fetch=True)
+    for row in rows:
+        if HISTORY_LAYOUT == "wide":
+            elem_id, value, recorded_at = row
+        else:
+            elem_id, value_type, *columns, recorded_at = row
+            value = decode_value(value_type, *columns)
+        last[elem_id] = (value, recorded_at)
+    return last
+
+
+def encode_value(value, value_type):
+    """
+    Returns the (value, value_num, value_bool, value_json) columns for a value of the declared type.
+
+    A value that cannot be converted to its declared type is kept as text
+    rather than dropped.
+    """
+    if value is None:
+        return None, None, None, None
+    try:
+        if value_type in ("integer", "float"):
+            return None, float(value), None, None
+        if value_type == "boolean":
+            if isinstance(value, str):
+                if value.lower() not in ("true", "false"):
+                    raise ValueError(value)
+                return None, None, value.lower() == "true", None
+            return None, None, bool(value), None
+        if value_type == "json":
+            return None, None, None, Json(value)
+    except (TypeError, ValueError):
+        pass
+    return (json.dumps(value) if isinstance(value, (dict, list)) else str(value)), None, None, None
+
+
+def decode_value(value_type, value, value_num, value_bool, value_json):
+    """
+    Turns the value columns of an element or history row back into a JSON-ready Python value.
+    """
+    if value_num is not None:
+        if value_type == "integer" and value_num.is_integer():
+            return int(value_num)
+        return value_num
+    if value_bool is not None:
+        return value_bool
+    if value_json is not None:
+        return value_json
+    return value
+
 
 def ensure_aas_structure_mir(conn, data):
     """
     Ensures the AAS and related submodels/elements exist for a MiR robot.
     """
-    _ensure_aas_structure(conn, data, MIR_SUBMODEL_TEMPLATE)
+    _ensure_aas_structure(conn, data, MIR_SUBMODEL_TEMPLATE, "mir")
 
 
 def ensure_aas_structure_kuka(conn, data):
     """
     Ensures the AAS and related submodels/elements exist for a KUKA robot.
     """
-    _ensure_aas_structure(conn, data, KUKA_SUBMODEL_TEMPLATE)
+    _ensure_aas_structure(conn, data, KUKA_SUBMODEL_TEMPLATE, "kuka")
+
+
+def template_hash(submodel_template):
+    """
+    Returns a short hash identifying a submodel template (titles, keys and value types).
+    """
+    canonical = json.dumps(submodel_template, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
 
 
-def _ensure_aas_structure(conn, data, submodel_template):
+def is_provisioned(aas_id, submodel_template):
+    """
+    Tells whether this process already provisioned the AAS from this template;
+    if so, ensure calls for it do no database work.
+    """
+    with _structure_ids_lock:
+        return _provisioned.get(aas_id) == template_hash(submodel_template)
+
+
+@timed("ensure")
+def _ensure_aas_structure(conn, data, submodel_template, robot_type):
     """
     Generic function to ensure the AAS and related submodels/elements exist for a given template.
+
+    Provisioning runs once per robot and template: the hash of the template
+    it was done for is kept in aas.template_hash and in this process, so
+    later calls return without a query until the template changes. Missing
+    submodels and elements are then created by one set-based statement;
+    existing ones are left as they are.
+
+    An AAS keeps the robot type it was first provisioned as; ensuring it as
+    another type raises ValueError and changes nothing.
     """
     aas_id = data["serial_number"]
-    aas_name = data["robot_name"]
-    aas_description = f"AAS for {aas_name}"
+    digest = template_hash(submodel_template)
+    with _structure_ids_lock:
+        if _provisioned.get(aas_id) == digest:
+            return
 
     with conn.cursor() as cur:
-        # Ensure AAS exists
-        cur.execute("SELECT id FROM aas WHERE id = %s", (aas_id,))
-        if cur.fetchone() is None:
-            cur.execute(
-                "INSERT INTO aas (id, name, description) VALUES (%s, %s, %s)",
-                (aas_id, aas_name, aas_description)
-            )
-
-        # Ensure submodels and submodel_elements
+        cur.execute("SELECT template_hash, robot_type FROM aas WHERE id = %s", (aas_id,))
+        row = cur.fetchone()
+        if row is not None and row == (digest, robot_type):
+            conn.rollback()
+            with _structure_ids_lock:
+                _provisioned[aas_id] = digest
+            return
+
+        elements = []
         for submodel_name, keys in submodel_template.items():
-            # Check if submodel for this AAS and title exists
-            cur.execute("SELECT id FROM submodel WHERE aas_id = %s AND title = %s", (aas_id, submodel_name))
-            row = cur.fetchone()
-            if row is None:
-                sm_id = str(uuid.uuid4())
-                cur.execute("""
-                    INSERT INTO submodel (id, aas_id, title, semantic_id)
-                    VALUES (%s, %s, %s, %s)
-                """, (sm_id, aas_id, submodel_name, f"http://omnifactory-assets.com/{submodel_name}"))
-            else:
-                sm_id = row[0]
-
-            # Ensure elements for this submodel
-            cur.execute("SELECT key, id FROM submodel_element WHERE submodel_id = %s", (sm_id,))
-            existing_keys = {r[0]: r[1] for r in cur.fetchall()}
+            sm_id = str(uuid.uuid4())
+            for k, value_type in keys.items():
+                elements.append({"submodel_id": sm_id, "title": submodel_name, "element_id": str(uuid.uuid4()),
+                                 "key": k, "value_type": value_type})
+        params = {"aas_id": aas_id, "name": data["robot_name"], "description": f"AAS for {data['robot_name']}",
+                  "robot_type": robot_type, "elements": Json(elements)}
+        cur.execute(_PROVISION, params)
+        created = cur.fetchone()[0]
 
-            for k in keys:
-                if k not in existing_keys:
-                    elem_uuid = str(uuid.uuid4())
-                    cur.execute("""
-                        INSERT INTO submodel_element (id, submodel_id, key, value, value_type)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (elem_uuid, sm_id, k, None, "string"))
+        # Checked after provisioning so that an AAS another process created
+        # concurrently (as whatever type) is locked and seen here
+        cur.execute("UPDATE aas SET robot_type = COALESCE(robot_type, %s) WHERE id = %s RETURNING robot_type",
+                    (robot_type, aas_id))
+        stored_type = cur.fetchone()[0]
+        if stored_type != robot_type:
+            conn.rollback()
+            raise ValueError(f"{aas_id} is a {stored_type} robot, not {robot_type}")
+
+        # A submodel another process inserted concurrently is not visible to the
+        # statement above, so its elements are created by a second pass
+        ids = _load_structure_ids(cur, aas_id)
+        if any(k not in ids.get(title, (None, {}))[1] for title, keys in submodel_template.items() for k in keys):
+            cur.execute(_PROVISION, params)
+            created += cur.fetchone()[0]
+            ids = _load_structure_ids(cur, aas_id)
 
+        if created:
+            # New elements change the read responses as much as new values do
+            cur.execute("UPDATE submodel SET version = version + 1, updated_at = NOW() WHERE aas_id = %s", (aas_id,))
+            cur.execute("UPDATE aas SET version = version + 1, updated_at = NOW(), template_hash = %s WHERE id = %s",
+                        (digest, aas_id))
+            publish(cur, [{"aas_id": aas_id}])
+        else:
+            cur.execute("UPDATE aas SET template_hash = %s WHERE id = %s", (digest, aas_id))
         conn.commit()
 
+    with _structure_ids_lock:
+        _structure_ids[aas_id] = ids
+        _provisioned[aas_id] = digest
+
+
+def robot_types(conn, aas_ids):
+    """
+    Returns the robot type each of the given AAS was provisioned as, by AAS ID;
+    AAS that do not exist (or have no type yet) are left out.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, robot_type FROM aas WHERE id = ANY(%s) AND robot_type IS NOT NULL",
+                    (list(aas_ids),))
+        types = dict(cur.fetchall())
+    conn.rollback()
+    return types
+
+
+def _attach_versions(events, versions):
+    """
+    Adds the AAS and submodel versions (aas id, version, updated_at, title,
+    submodel version, submodel updated_at rows) to the last event of each AAS.
+    """
+    by_aas = {}
+    for aas_id, version, updated_at, title, sm_version, sm_updated_at in versions:
+        entry = by_aas.setdefault(aas_id, {"version": version, "updated_at": updated_at.isoformat(),
+                                           "submodel_versions": {}})
+        entry["submodel_versions"][title] = [sm_version, sm_updated_at.isoformat()]
+    for event in reversed(events):
+        entry = by_aas.pop(event["aas_id"], None)
+        if entry is not None:
+            event.update(entry)
+
+
+def _change_events(samples, current_values, changed_ids):
+    """
+    Builds one change event per sample that set a current value the UPDATE changed.
+    """
+    changed = {}
+    for elem_id in changed_ids:
+        columns, index, sampled_at, submodel_name, key, value_type = current_values[elem_id]
+        event = changed.get(index)
+        if event is None:
+            event = changed[index] = {
+                "aas_id": samples[index][0]["serial_number"],
+                "recorded_at": sampled_at.isoformat(),
+                "values": {}
+            }
+        event["values"].setdefault(submodel_name, {})[key] = _event_value(value_type, columns)
+    return [changed[index] for index in sorted(changed)]
+
 
 def store_data_point_mir(conn, data):
     """
@@ -82,35 +474,221 @@ def _store_data_point(conn, data, submodel_template):
     """
     Generic function to store a data point for a given template.
     """
-    aas_id = data["serial_number"]
+    store_samples(conn, [(data, submodel_template, None)])
+
+
+@timed("store")
+def store_samples(conn, samples):
+    """
+    Stores many data points in one transaction.
+
+    `samples` is a list of (data, submodel_template, recorded_at) tuples;
+    a recorded_at of None stamps the rows with the database's NOW().
+    A data point carrying a "sample_id" gets history row IDs derived from
+    it, so storing the same data point with the same recorded_at again (a
+    replay after a lost acknowledgement) adds no duplicate rows.
+    History rows go out as one multi-row INSERT and current values as one
+    set-based UPDATE, whatever the number of samples. Keys with a recording
+    policy (RECORDING_POLICIES) only get a history row when the policy asks
+    for one, and current values are only rewritten, and change events only
+    published, when they differ from what the database holds. A sample older
+    than the newest one stored for an element (a late or back-dated batch)
+    only adds history for that element, even if the newer sample repeated
+    the value.
+
+    The policies compare against the last history row, refreshed from the
+    database before each batch. They assume one writer per robot: two
+    processes storing the same robot at the same time may both record a
+    row the policy would have skipped.
+
+    With HISTORY_LAYOUT = "wide" a sample gets one history row per submodel,
+    holding the recorded keys of that submodel, instead of one per key.
+    """
+    history_rows = []
+    # element id -> (columns, index of the sample, sampled at, submodel title, key, value_type)
+    current_values = {}
+    # Decisions made for this batch; merged into the module state only after commit
+    recorded = {}
 
     with conn.cursor() as cur:
-        for submodel_name, keys in submodel_template.items():
-            # Find the submodel_id for this AAS and submodel_name
-            cur.execute("SELECT id FROM submodel WHERE aas_id = %s AND title = %s", (aas_id, submodel_name))
-            row = cur.fetchone()
-            if not row:
-                continue
-            sm_id = row[0]
+        with stage("lookup"):
+            structures = [_resolve_structure_ids(cur, data["serial_number"]) for data, _, _ in samples]
 
-            # Get current elements
-            cur.execute("SELECT key, id FROM submodel_element WHERE submodel_id = %s", (sm_id,))
-            key_to_id = {r[0]: r[1] for r in cur.fetchall()}
+        with stage("policy_state"):
+            last_recorded = _refresh_last_recorded(cur, _policy_elements(samples, structures))
 
-            for k in keys:
-                if k in data:
-                    v = data[k]
-                    value_str = json.dumps(v) if isinstance(v, (dict, list)) else str(v)
-                    elem_id = key_to_id[k]
+        for index, ((data, submodel_template, recorded_at), structure_ids) in enumerate(zip(samples, structures)):
+            sampled_at = recorded_at or datetime.now()
+            sample_id = data.get("sample_id")
 
-                    hist_id = str(uuid.uuid4())
-                    # Insert history
-                    cur.execute("""
-                        INSERT INTO submodel_element_history (id, submodel_element_id, value, recorded_at)
-                        VALUES (%s, %s, %s, NOW())
-                    """, (hist_id, elem_id, value_str))
+            for submodel_name, keys in submodel_template.items():
+                # Element IDs of this submodel, resolved from the cache
+                sm_id, key_to_id = structure_ids.get(submodel_name, (None, None))
+                if not key_to_id:
+                    continue
+                policies = RECORDING_POLICIES.get(submodel_name, {})
+                sample_values = {}
 
-                    # Update current value
-                    cur.execute("UPDATE submodel_element SET value = %s WHERE id = %s", (value_str, elem_id))
+                for k, value_type in keys.items():
+                    if k in data and k in key_to_id:
+                        v = data[k]
+                        elem_id = key_to_id[k]
+                        last = recorded[elem_id] if elem_id in recorded else last_recorded.get(elem_id)
 
-        conn.commit()
+                        columns = encode_value(v, value_type)
+                        if _should_record(policies.get(k, ALWAYS_RECORD), v, sampled_at, last):
+                            if HISTORY_LAYOUT == "wide":
+                                sample_values[k] = _json_value(columns)
+                            else:
+                                hist_id = uuid.uuid5(HISTORY_ID_NAMESPACE, f"{sample_id}/{elem_id}") if sample_id else uuid.uuid4()
+                                history_rows.append((str(hist_id), elem_id) + columns + (recorded_at,))
+                            recorded[elem_id] = (v, sampled_at)
+
+                        # The newest sample of the batch sets the current value
+                        if elem_id not in current_values or sampled_at >= current_values[elem_id][2]:
+                            current_values[elem_id] = (columns, index, sampled_at, submodel_name, k, value_type)
+
+                if sample_values:
+                    hist_id = uuid.uuid5(HISTORY_ID_NAMESPACE, f"{sample_id}/{sm_id}") if sample_id else uuid.uuid4()
+                    history_rows.append((str(hist_id), sm_id, Json(sample_values), recorded_at))
+
+        if history_rows and HISTORY_LAYOUT == "wide":
+            # Insert history, one row per submodel and sample, and fold it into the rollups
+            with stage("history_insert"):
+                execute_values(cur, _WIDE_HISTORY_INSERT, history_rows, template="(%s, %s, %s, COALESCE(%s, NOW()))", page_size=len(history_rows))
+        elif history_rows:
+            # Insert history and fold it into the rollups
+            with stage("history_insert"):
+                execute_values(cur, _NARROW_HISTORY_INSERT, history_rows, template="(%s, %s, %s, %s, %s, %s, COALESCE(%s, NOW()))", page_size=len(history_rows))
+
+        if current_values:
+            # Update current values that changed, unless the database holds a newer
+            # sample, and bump the versions of their submodels and AAS in the same
+            # statement (the ETags of the read routes). A newer sample repeating
+            # the current value only advances value_recorded_at, so a late sample
+            # between the two cannot replace it; the predicates keep the two
+            # element updates on disjoint rows
+            with stage("current_update"):
+                updated = execute_values(cur, """
+                    WITH v AS (
+                        SELECT * FROM (VALUES %s) AS v(id, value, value_num, value_bool, value_json, recorded_at)
+                    ), e AS (
+                        UPDATE submodel_element AS e
+                        SET value = v.value, value_num = v.value_num, value_bool = v.value_bool, value_json = v.value_json,
+                            value_recorded_at = v.recorded_at
+                        FROM v
+                        WHERE e.id = v.id
+                          AND (e.value_recorded_at IS NULL OR v.recorded_at >= e.value_recorded_at)
+                          AND (e.value, e.value_num, e.value_bool, e.value_json)
+                              IS DISTINCT FROM (v.value, v.value_num, v.value_bool, v.value_json)
+                        RETURNING e.id, e.submodel_id
+                    ), unchanged AS (
+                        UPDATE submodel_element AS e
+                        SET value_recorded_at = v.recorded_at
+                        FROM v
+                        WHERE e.id = v.id
+                          AND (e.value_recorded_at IS NULL OR v.recorded_at > e.value_recorded_at)
+                          AND (e.value, e.value_num, e.value_bool, e.value_json)
+                              IS NOT DISTINCT FROM (v.value, v.value_num, v.value_bool, v.value_json)
+                    ), s AS (
+                        UPDATE submodel SET version = version + 1, updated_at = NOW()
+                        WHERE id IN (SELECT submodel_id FROM e)
+                        RETURNING id, aas_id, title, version, updated_at
+                    ), a AS (
+                        UPDATE aas SET version = version + 1, updated_at = NOW()
+                        WHERE id IN (SELECT aas_id FROM s)
+                        RETURNING id, version, updated_at
+                    )
+                    SELECT e.id, a.id, a.version, a.updated_at, s.title, s.version, s.updated_at
+                    FROM e JOIN s ON s.id = e.submodel_id JOIN a ON a.id = s.aas_id
+                """, [(elem_id,) + entry[0] + (samples[entry[1]][2],) for elem_id, entry in current_values.items()],
+                    template="(%s::uuid, %s, %s::float8, %s::boolean, %s::jsonb, COALESCE(%s::timestamp, LOCALTIMESTAMP))",
+                    page_size=len(current_values), fetch=True)
+
+            # Announce the values the UPDATE changed to API processes once this
+            # commits; the last event of each AAS carries the versions this commit
+            # leaves behind
+            events = _change_events(samples, current_values, [row[0] for row in updated])
+            _attach_versions(events, {row[1:] for row in updated})
+            publish(cur, events)
+
+        with stage("commit"):
+            conn.commit()
+    ingested_samples.inc(len(samples))
+
+    with _recording_state_lock:
+        _last_recorded.update((elem_id, entry) for elem_id, entry in last_recorded.items() if entry is not None)
+        _last_recorded.update(recorded)
+
+
+class BatchWriter:
+    """
+    Buffers data points from all robots and writes them with store_samples.
+
+    `connection` is a context manager factory such as db_setup.connection;
+    each flush borrows one connection for its transaction.
+
+    A background thread flushes the buffer every `flush_interval` seconds,
+    or as soon as `max_samples` data points are waiting. Samples are stamped
+    when they are submitted, so batching does not shift their recorded_at.
+    close() flushes whatever is still buffered.
+    """
+
+    def __init__(self, connection, flush_interval=BATCH_FLUSH_INTERVAL, max_samples=BATCH_MAX_SAMPLES,
+                 max_pending=BATCH_MAX_PENDING):
+        self._connection = connection
+        self.flush_interval = flush_interval
+        self.max_samples = max_samples
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, data, submodel_template):
+        """
+        Queues one data point for the next flush.
+        """
+        with self._lock:
+            self._pending.append((data, submodel_template, datetime.now()))
+            full = len(self._pending) >= self.max_samples
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes all queued data points in one transaction.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            try:
+                with self._connection() as conn:
+                    store_samples(conn, batch)
+            except Exception as e:
+                with self._lock:
+                    # Keep the failed batch for the next attempt, dropping the oldest beyond max_pending
+                    self._pending = (batch + self._pending)[-self.max_pending:]
+                print(f"Batch flush of {len(batch)} samples failed: {e}")
+
+    def close(self):
+        """
+        Stops the flush thread and writes the remaining data points.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
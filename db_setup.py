@@ -1,58 +1,253 @@
 # db_setup.py
 
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import extensions
 from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from config import DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL
+import metrics
 
 def get_connection():
+    """
+    Opens a new, unpooled connection. Use connection() for normal work.
+    """
     return psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
         host=DB_HOST,
-        port=DB_PORT
+        port=DB_PORT,
+        # Counts statements for the metrics while they are enabled
+        cursor_factory=metrics.InstrumentedCursor if metrics.enabled else None
     )
 
-def create_tables_if_not_exist(conn):
-    with conn.cursor() as cur:
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS aas (
-            id VARCHAR(255) PRIMARY KEY,
-            name VARCHAR(255),
-            description TEXT,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS submodel (
-            id UUID PRIMARY KEY,
-            aas_id VARCHAR(255) REFERENCES aas(id),
-            title VARCHAR(255),
-            semantic_id VARCHAR(255),
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS submodel_element (
-            id UUID PRIMARY KEY,
-            submodel_id UUID REFERENCES submodel(id),
-            key VARCHAR(255),
-            value TEXT,
-            value_type VARCHAR(50),
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS submodel_element_history (
-            id UUID PRIMARY KEY,
-            submodel_element_id UUID REFERENCES submodel_element(id),
-            value TEXT,
-            recorded_at TIMESTAMP DEFAULT NOW()
-        );
-        """)
-
-        conn.commit()
-
-create_tables_if_not_exist(get_connection())
\ No newline at end of file
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no pooled connection becomes free within the borrow timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by the ingest threads and the API.
+
+    At most `max_size` connections are open at once; a borrower waits up to
+    `timeout` seconds for one to be returned before PoolTimeoutError is raised.
+    A connection that sat idle for longer than `healthcheck_interval` seconds is
+    checked with SELECT 1 before it is handed out, and replaced if it is dead.
+    """
+
+    def __init__(self, connect=get_connection, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, monotonic time it was returned)
+        self._size = 0   # open connections, idle and borrowed
+        self._closed = False
+        self._stats = {
+            "borrows": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "healthcheck_failures": 0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self, timeout=None):
+        """
+        Borrows a connection, waiting up to `timeout` seconds for a free one.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot and connect outside the lock
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection free after {timeout}s ({self.max_size} in use)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            self._stats["borrows"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds"] += time.monotonic() - started
+
+        if conn is not None and not self._is_healthy(conn, returned_at):
+            self._close_quietly(conn)
+            with self._cond:
+                self._stats["healthcheck_failures"] += 1
+                self._stats["connections_discarded"] += 1
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._new_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns a borrowed connection, rolling back any transaction left open.
+        """
+        if not discard and not conn.closed:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or conn.closed or self._closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._stats["connections_discarded"] += 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        """
+        Returns a snapshot of pool usage counters.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+            })
+        return stats
+
+    def closeall(self):
+        """
+        Closes idle connections; borrowed ones are closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+@contextmanager
+def connection(timeout=None):
+    """
+    Borrows a connection from the shared pool for the duration of a with-block.
+    """
+    pool = get_pool()
+    with metrics.stage("connect"):
+        conn = pool.getconn(timeout)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+def pool_stats():
+    """
+    Returns usage counters of the shared pool.
+    """
+    return get_pool().stats()
+
+def _pool_metrics():
+    with _pool_lock:
+        pool = _pool
+    if pool is None:
+        return []
+    stats = pool.stats()
+    return [
+        (f"aas_db_pool_{name}" if name in ("size", "idle", "in_use", "max_size") else f"aas_db_pool_{name}_total",
+         "gauge" if name in ("size", "idle", "in_use", "max_size") else "counter",
+         f"Connection pool {name.replace('_', ' ')}.", value)
+        for name, value in stats.items()
+    ]
+
+metrics.register_collector(_pool_metrics)
+
+def close_pool():
+    """
+    Closes the shared pool, e.g. on shutdown.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
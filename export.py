@@ -0,0 +1,246 @@
+# export.py
+#
+# Columnar export of the element history for analysis tools:
+#
+#   python export.py out/ --aas SN-MIR1234 --key velocity --from 2024-05-01 --to 2024-05-08
+#   python export.py out/ --format arrow
+#
+# writes out/date=2024-05-01/aas_id=SN-MIR1234/history.parquet and so on, one
+# file per day and robot (the Hive layout pandas, DuckDB and Spark read as a
+# partitioned dataset). Rows come from a named server-side cursor in batches
+# of EXPORT_BATCH_ROWS and are written batch by batch, so memory stays bounded
+# whatever the number of rows. The Flask app serves the same data as a single
+# file on /aas/export. Needs pyarrow (pip install pyarrow).
+
+import argparse
+import os
+import sys
+from datetime import timedelta
+from config import EXPORT_BATCH_ROWS
+from data_logic import HISTORY_TABLE
+from history import parse_timestamp, HISTORY_ROWS
+from partitions import list_partitions, partition_start
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+if pa is not None:
+    SCHEMA = pa.schema([
+        ("aas_id", pa.string()),
+        ("submodel", pa.string()),
+        ("key", pa.string()),
+        ("value_type", pa.string()),
+        ("recorded_at", pa.timestamp("us")),
+        ("value_num", pa.float64()),
+        ("value_bool", pa.bool_()),
+        ("value", pa.string()),
+        ("value_json", pa.string()),
+    ])
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("History export needs pyarrow; install it with `pip install pyarrow`")
+
+
+def history_range(conn):
+    """
+    Returns the (start, end) covered by the history partitions, or (None, None).
+    """
+    with conn.cursor() as cur:
+        partitions = list_partitions(cur, HISTORY_TABLE)
+    conn.rollback()
+    if not partitions:
+        return None, None
+    return partitions[0][1], partitions[-1][2]
+
+
+def iter_history_batches(conn, start, end, aas_ids=None, submodels=None, keys=None, batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Yields ((day, aas_id), RecordBatch) for the history rows in [start, end).
+
+    Runs one query per day through a named (server-side) cursor, ordered by
+    robot and time, so at most `batch_rows` rows are held at once and every
+    batch belongs to a single day and robot.
+    """
+    require_pyarrow()
+    conditions = []
+    params = {}
+    if aas_ids:
+        conditions.append("s.aas_id = ANY(%(aas)s)")
+        params["aas"] = list(aas_ids)
+    if submodels:
+        conditions.append("s.title = ANY(%(submodel)s)")
+        params["submodel"] = list(submodels)
+    if keys:
+        conditions.append("e.key = ANY(%(key)s)")
+        params["key"] = list(keys)
+    filters = "".join(" AND " + condition for condition in conditions)
+
+    day = partition_start(start, "daily")
+    while day < end:
+        day_start, day_end = max(day, start), min(day + timedelta(days=1), end)
+        # A named cursor keeps the result on the server; fetchmany() pulls one batch at a time
+        with conn.cursor(name="history_export") as cur:
+            cur.itersize = batch_rows
+            cur.execute(f"""
+                SELECT s.aas_id, s.title, e.key, e.value_type, h.recorded_at,
+                       h.value_num, h.value_bool, h.value, h.value_json::text
+                FROM {HISTORY_ROWS} AS h
+                JOIN submodel_element e ON e.id = h.submodel_element_id
+                JOIN submodel s ON s.id = e.submodel_id
+                WHERE h.recorded_at >= %(start)s AND h.recorded_at < %(end)s{filters}
+                ORDER BY s.aas_id, h.recorded_at, h.id
+            """, dict(params, start=day_start, end=day_end))
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                # Split the batch where the robot changes
+                first = 0
+                for i in range(1, len(rows) + 1):
+                    if i == len(rows) or rows[i][0] != rows[first][0]:
+                        yield (day.date(), rows[first][0]), _record_batch(rows[first:i])
+                        first = i
+        conn.rollback()
+        day += timedelta(days=1)
+
+
+def _record_batch(rows):
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)],
+        schema=SCHEMA
+    )
+
+
+def open_writer(sink, format="parquet"):
+    """
+    Returns a writer of SCHEMA batches to `sink` (a path or file object) with write_batch() and close().
+    """
+    require_pyarrow()
+    if format == "parquet":
+        return pq.ParquetWriter(sink, SCHEMA, compression="zstd")
+    if format == "arrow":
+        return pa.ipc.new_file(sink, SCHEMA)
+    raise ValueError(f"Unknown export format: {format!r} (expected one of {sorted(FORMATS)})")
+
+
+def export_history(conn, out_dir, start=None, end=None, aas_ids=None, submodels=None, keys=None,
+                   format="parquet", batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Writes the selected history to one file per day and robot under `out_dir`.
+
+    `start`/`end` default to the range of the history partitions. Returns
+    the written paths with their row counts.
+    """
+    require_pyarrow()
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format: {format!r} (expected one of {sorted(FORMATS)})")
+    if start is None or end is None:
+        first, last = history_range(conn)
+        if first is None:
+            return []
+        start = first if start is None else start
+        end = last if end is None else end
+
+    written = []
+    current, writer, rows = None, None, 0
+    try:
+        for (day, aas_id), batch in iter_history_batches(conn, start, end, aas_ids, submodels, keys, batch_rows):
+            if (day, aas_id) != current:
+                if writer is not None:
+                    writer.close()
+                    written.append((path, rows))
+                directory = os.path.join(out_dir, f"date={day.isoformat()}", f"aas_id={aas_id}")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, "history" + FORMATS[format])
+                current, writer, rows = (day, aas_id), open_writer(path, format), 0
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+            written.append((path, rows))
+    return written
+
+
+class _ChunkSink:
+    """
+    Write-only file object that collects what a writer produced until it is taken.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_history(conn, start, end, aas_ids=None, submodels=None, keys=None, format="parquet",
+                   batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Yields the selected history as one Parquet/Arrow file, chunk by chunk, for
+    streaming HTTP responses; each chunk covers at most one cursor batch.
+    """
+    sink = _ChunkSink()
+    writer = open_writer(pa.PythonFile(sink, mode="w"), format)
+    for _, batch in iter_history_batches(conn, start, end, aas_ids, submodels, keys, batch_rows):
+        writer.write_batch(batch)
+        chunk = sink.take()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.take()
+
+
+def main():
+    from db_setup import get_connection
+
+    parser = argparse.ArgumentParser(description="Export element history as Parquet/Arrow files per day and robot.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--aas", action="append", help="AAS ID to export (repeatable; default: all)")
+    parser.add_argument("--submodel", action="append", help="submodel title (repeatable)")
+    parser.add_argument("--key", action="append", help="element key (repeatable)")
+    parser.add_argument("--from", dest="start", type=parse_timestamp, help="ISO 8601 start, inclusive")
+    parser.add_argument("--to", dest="end", type=parse_timestamp, help="ISO 8601 end, exclusive")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--batch-rows", type=int, default=EXPORT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        written = export_history(conn, args.out_dir, args.start, args.end, args.aas, args.submodel, args.key,
+                                 args.format, args.batch_rows)
+    finally:
+        conn.close()
+    for path, rows in written:
+        print(f"{path}: {rows} rows")
+    print(f"Exported {sum(rows for _, rows in written)} rows to {len(written)} files")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
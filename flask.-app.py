@@ -1,167 +1,638 @@
-from flask import Flask, jsonify
-from db_setup import get_connection
+import json
+import time
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from db_setup import connection, get_connection, PoolTimeoutError
+from datetime import datetime, timedelta
+from config import HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT, HISTORY_MAX_POINTS
+from config import AGGREGATE_DEFAULT_RANGE, AGGREGATE_MAX_BUCKETS
+from config import LIVE_STREAM_HEARTBEAT, INGEST_MAX_SAMPLES
+from migrations import require_current_schema
+from data_logic import VALUE_COLUMNS, decode_value
+from history import parse_timestamp, fetch_history_page, fetch_downsampled_history, iter_history
+from history import AGGREGATES, parse_bucket, fetch_aggregates, decode_cursor
+from change_feed import ChangeListener
+from live_model import LiveModel
+from live_hub import StreamHub
+from ingest import parse_ndjson, ingest_samples
+import metrics
+import export
 
 app = Flask(__name__)
 
+# Value columns of submodel_element aliased as "e"
+ELEMENT_VALUE_COLUMNS = ", ".join("e." + column for column in VALUE_COLUMNS.split(", "))
+
+# Current values of all AAS shells, kept in memory from the change events of the ingest path
+live_model = LiveModel(connection)
+change_listener = ChangeListener(get_connection)
+change_listener.subscribe(live_model.apply, live_model.reset)
+
+# Fans change events out to /stream clients; a reset tells them events may have been missed
+stream_hub = StreamHub()
+change_listener.subscribe(stream_hub.publish, lambda: stream_hub.publish({"reset": True}))
+
+@app.before_request
+def start_change_listener():
+    # Started on first use rather than at import, so the reloader's parent process stays idle
+    change_listener.start()
+
+@app.before_request
+def start_request_metrics():
+    if metrics.enabled:
+        g.metrics_started = (time.perf_counter(), metrics.statement_count())
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses are measured up to their first byte
+    if metrics.enabled and "metrics_started" in g:
+        started, statements = g.metrics_started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.http_request_seconds.observe(time.perf_counter() - started, route=route,
+                                             method=request.method, status=response.status_code)
+        metrics.http_statements.inc(metrics.statement_count() - statements, route=route)
+    return response
+
+def validated_response(response, etag, last_modified):
+    """
+    Adds the ETag and Last-Modified validators to a response.
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def is_not_modified(etag, last_modified):
+    """
+    True when the request's If-None-Match, or else If-Modified-Since, matches the validators.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have whole-second resolution
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def not_modified_response(etag, last_modified):
+    return validated_response(app.response_class(status=304), etag, last_modified)
+
+def version_etag(version):
+    return f"v{version}"
+
+def live_shell(aas_id):
+    """
+    Returns (True, snapshot or None) from the live model while change events
+    arrive, else (False, None): the route then reads the database.
+    """
+    if not change_listener.is_listening():
+        return False, None
+    return True, live_model.get(aas_id)
+
+def live_response(data, version, updated_at):
+    """
+    Renders data from the live model with its validators (a 304 when the client
+    already has it). Without a version, while a commit's events are applied,
+    the response has no validators.
+    """
+    if version is None:
+        return jsonify(data), 200
+    etag = version_etag(version)
+    if is_not_modified(etag, updated_at):
+        return not_modified_response(etag, updated_at)
+    return validated_response(jsonify(data), etag, updated_at), 200
+
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e):
+    """
+    Answers 503 when every pooled database connection stays busy past the borrow timeout.
+    """
+    return jsonify({"error": "Database busy, try again later"}), 503
+
 @app.route('/aas/<aas_id>', methods=['GET'])
 def get_aas_data(aas_id):
     """
     Fetch details of a specific AAS by its ID, including submodels and their elements.
+
+    Supports conditional GET: the ETag is the AAS version maintained by the
+    ingest path, so an unchanged AAS is answered with 304 after a version lookup.
+    Served from the live model while it is fed by change events.
     """
-    conn = get_connection()
-    try:
+    live, shell = live_shell(aas_id)
+    if live:
+        if shell is None:
+            return jsonify({"error": "AAS not found"}), 404
+        aas_data = {
+            "id": shell["id"],
+            "name": shell["name"],
+            "description": shell["description"],
+            "submodels": [
+                {"id": submodel["id"], "title": title, "semantic_id": submodel["semantic_id"],
+                 "values": submodel["values"]}
+                for title, submodel in shell["submodels"].items()
+            ]
+        }
+        return live_response(aas_data, shell["version"], shell["updated_at"])
+
+    with connection() as conn:
         cur = conn.cursor()
 
-        # Fetch AAS basic info
-        cur.execute("SELECT id, name, description FROM aas WHERE id = %s", (aas_id,))
-        aas_row = cur.fetchone()
-        if not aas_row:
+        # Cheap version check before building the body
+        cur.execute("SELECT version, updated_at FROM aas WHERE id = %s", (aas_id,))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"error": "AAS not found"}), 404
+        if is_not_modified(version_etag(row[0]), row[1]):
+            return not_modified_response(version_etag(row[0]), row[1])
+
+        # Fetch the AAS with all submodels and elements in one round trip
+        cur.execute(f"""
+        SELECT a.id, a.name, a.description, a.version, a.updated_at, s.id, s.title, s.semantic_id,
+               e.key, e.value_type, {ELEMENT_VALUE_COLUMNS}
+        FROM aas a
+        LEFT JOIN submodel s ON s.aas_id = a.id
+        LEFT JOIN submodel_element e ON e.submodel_id = s.id
+        WHERE a.id = %s
+        ORDER BY s.created_at, s.title, e.created_at, e.key
+        """, (aas_id,))
+        rows = cur.fetchall()
+        if not rows:
             return jsonify({"error": "AAS not found"}), 404
 
         aas_data = {
-            "id": aas_row[0],
-            "name": aas_row[1],
-            "description": aas_row[2],
+            "id": rows[0][0],
+            "name": rows[0][1],
+            "description": rows[0][2],
             "submodels": []
         }
+        etag, last_modified = version_etag(rows[0][3]), rows[0][4]
 
-        # Fetch Submodels for this AAS
-        cur.execute("SELECT id, title, semantic_id FROM submodel WHERE aas_id = %s", (aas_id,))
-        submodels = cur.fetchall()
-
-        for sm_id, sm_title, sm_semantic_id in submodels:
-            # Fetch elements for each submodel
-            cur.execute("SELECT key, value FROM submodel_element WHERE submodel_id = %s", (sm_id,))
-            elements = cur.fetchall()
-
-            # Convert elements into a dictionary
-            elements_dict = {key: value for key, value in elements}
+        # Group the rows into submodels with a dictionary of typed values each
+        submodels = {}
+        for row in rows:
+            sm_id = row[5]
+            if sm_id is None:
+                continue
+            if sm_id not in submodels:
+                submodels[sm_id] = {
+                    "id": str(sm_id),
+                    "title": row[6],
+                    "semantic_id": row[7],
+                    "values": {}
+                }
+                aas_data["submodels"].append(submodels[sm_id])
+            if row[8] is not None:
+                submodels[sm_id]["values"][row[8]] = decode_value(*row[9:])
 
-            submodel_data = {
-                "id": str(sm_id),
-                "title": sm_title,
-                "semantic_id": sm_semantic_id,
-                "values": elements_dict
-            }
-            aas_data["submodels"].append(submodel_data)
-
-        return jsonify(aas_data), 200
-    finally:
-        conn.close()
+    return validated_response(jsonify(aas_data), etag, last_modified), 200
 
 @app.route('/aas/<aas_id>/submodel/<submodel_name>', methods=['GET'])
 def get_submodel_data(aas_id, submodel_name):
     """
     Fetch details of a specific submodel for a given AAS.
+
+    Supports conditional GET on the submodel version.
     """
-    conn = get_connection()
-    try:
+    live, shell = live_shell(aas_id)
+    if live:
+        submodel = shell["submodels"].get(submodel_name) if shell is not None else None
+        if submodel is None:
+            return jsonify({"error": "Submodel not found for the given AAS"}), 404
+        submodel_data = {"submodel_name": submodel_name, "values": submodel["values"]}
+        return live_response(submodel_data, submodel["version"], submodel["updated_at"])
+
+    with connection() as conn:
         cur = conn.cursor()
 
-        # Fetch Submodel ID
-        cur.execute("""
-        SELECT id FROM submodel WHERE aas_id = %s AND title = %s
-        """, (aas_id, submodel_name))
+        # Cheap version check before building the body
+        cur.execute("SELECT version, updated_at FROM submodel WHERE aas_id = %s AND title = %s",
+                    (aas_id, submodel_name))
         row = cur.fetchone()
         if not row:
             return jsonify({"error": "Submodel not found for the given AAS"}), 404
-        sm_id = row[0]
+        if is_not_modified(version_etag(row[0]), row[1]):
+            return not_modified_response(version_etag(row[0]), row[1])
+
+        # Fetch the Submodel and its Elements in one round trip
+        cur.execute(f"""
+        SELECT s.version, s.updated_at, e.key, e.value_type, {ELEMENT_VALUE_COLUMNS}
+        FROM submodel s
+        LEFT JOIN submodel_element e ON e.submodel_id = s.id
+        WHERE s.aas_id = %s AND s.title = %s
+        """, (aas_id, submodel_name))
+        rows = cur.fetchall()
+        if not rows:
+            return jsonify({"error": "Submodel not found for the given AAS"}), 404
 
-        # Fetch Submodel Elements
-        cur.execute("SELECT key, value FROM submodel_element WHERE submodel_id = %s", (sm_id,))
-        elements = cur.fetchall()
-        elements_dict = {key: value for key, value in elements}
+        elements_dict = {row[2]: decode_value(*row[3:]) for row in rows if row[2] is not None}
+        etag, last_modified = version_etag(rows[0][0]), rows[0][1]
 
         submodel_data = {
             "submodel_name": submodel_name,
             "values": elements_dict
         }
 
-        return jsonify(submodel_data), 200
-    finally:
-        conn.close()
+    return validated_response(jsonify(submodel_data), etag, last_modified), 200
 
 @app.route('/aas/<aas_id>/submodel/<submodel_name>/element/<element_key>', methods=['GET'])
 def get_submodel_element(aas_id, submodel_name, element_key):
     """
     Fetch details of a specific element within a submodel for a given AAS.
-    """
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
 
-        # Fetch Submodel ID
-        cur.execute("""
-        SELECT id FROM submodel WHERE aas_id = %s AND title = %s
-        """, (aas_id, submodel_name))
-        row = cur.fetchone()
-        if not row:
+    Supports conditional GET on the version of the element's submodel.
+    """
+    live, shell = live_shell(aas_id)
+    if live:
+        submodel = shell["submodels"].get(submodel_name) if shell is not None else None
+        if submodel is None:
             return jsonify({"error": "Submodel not found for the given AAS"}), 404
-        sm_id = row[0]
+        if element_key not in submodel["values"]:
+            return jsonify({"error": "Element not found in the specified submodel"}), 404
+        element_data = {"key": element_key, "value": submodel["values"][element_key]}
+        return live_response(element_data, submodel["version"], submodel["updated_at"])
 
-        # Fetch Element Data
-        cur.execute("""
-        SELECT key, value FROM submodel_element WHERE submodel_id = %s AND key = %s
-        """, (sm_id, element_key))
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Fetch the Submodel version and the Element in one round trip; no element
+        # columns means the submodel exists but the element does not
+        cur.execute(f"""
+        SELECT s.version, s.updated_at, e.key, e.value_type, {ELEMENT_VALUE_COLUMNS}
+        FROM submodel s
+        LEFT JOIN submodel_element e ON e.submodel_id = s.id AND e.key = %s
+        WHERE s.aas_id = %s AND s.title = %s
+        """, (element_key, aas_id, submodel_name))
         element = cur.fetchone()
         if not element:
+            return jsonify({"error": "Submodel not found for the given AAS"}), 404
+        if element[2] is None:
             return jsonify({"error": "Element not found in the specified submodel"}), 404
 
-        element_data = {"key": element[0], "value": element[1]}
+        etag, last_modified = version_etag(element[0]), element[1]
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
 
-        return jsonify(element_data), 200
-    finally:
-        conn.close()
+        element_data = {"key": element[2], "value": decode_value(*element[3:])}
+
+    return validated_response(jsonify(element_data), etag, last_modified), 200
 
 @app.route('/aas/<aas_id>/submodel/<submodel_name>/element/<element_key>/history', methods=['GET'])
 def get_submodel_element_history(aas_id, submodel_name, element_key):
     """
     Fetch the history of a specific element within a submodel for a given AAS.
+
+    Query parameters:
+      from, to   ISO 8601 time range (from inclusive, to exclusive)
+      limit      rows per page, newest first; the next page's cursor is returned
+                 in the X-Next-Cursor header
+      cursor     continue after the page that returned this cursor
+      max_points downsample the range to at most this many buckets instead
+      stream     "ndjson" (also chosen by Accept: application/x-ndjson) or "json":
+                 stream every row of the range from a server-side cursor instead
+                 of returning a page; limit then defaults to no limit, and an
+                 element without history gives an empty result
     """
-    conn = get_connection()
+    stream = request.args.get("stream")
+    if stream is None and request.accept_mimetypes.best == "application/x-ndjson":
+        stream = "ndjson"
+    if stream not in (None, "json", "ndjson"):
+        return jsonify({"error": "stream must be json or ndjson"}), 400
     try:
+        start = parse_timestamp(request.args["from"]) if "from" in request.args else None
+        end = parse_timestamp(request.args["to"]) if "to" in request.args else None
+        if stream is not None:
+            limit = int(request.args["limit"]) if "limit" in request.args else None
+        else:
+            limit = min(int(request.args.get("limit", HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT)
+        max_points = int(request.args["max_points"]) if "max_points" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid from, to, limit or max_points parameter"}), 400
+    if (limit is not None and limit < 1) or (max_points is not None and not 1 <= max_points <= HISTORY_MAX_POINTS):
+        return jsonify({"error": f"limit must be positive and max_points between 1 and {HISTORY_MAX_POINTS}"}), 400
+    if stream is not None and max_points is not None:
+        return jsonify({"error": "stream cannot be combined with max_points"}), 400
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    with connection() as conn:
         cur = conn.cursor()
 
-        # Fetch Submodel ID
+        # Fetch Submodel and Element ID in one round trip
         cur.execute("""
-        SELECT id FROM submodel WHERE aas_id = %s AND title = %s
-        """, (aas_id, submodel_name))
-        row = cur.fetchone()
-        if not row:
+        SELECT e.id, e.value_type
+        FROM submodel s
+        LEFT JOIN submodel_element e ON e.submodel_id = s.id AND e.key = %s
+        WHERE s.aas_id = %s AND s.title = %s
+        """, (element_key, aas_id, submodel_name))
+        element = cur.fetchone()
+        if not element:
             return jsonify({"error": "Submodel not found for the given AAS"}), 404
-        sm_id = row[0]
+        if element[0] is None:
+            return jsonify({"error": "Element not found in the specified submodel"}), 404
+        elem_id, value_type = element
+
+        if stream is not None:
+            return stream_history(elem_id, value_type, start, end, cursor, limit, stream)
+
+        # Downsampled history for the Element
+        if max_points is not None:
+            buckets = fetch_downsampled_history(cur, elem_id, value_type, start, end, max_points)
+            if not buckets:
+                return jsonify({"error": "No history found for the specified element"}), 404
+            history_data = [
+                {"value": value, "recorded_at": recorded_at.isoformat(), "count": count}
+                for value, recorded_at, count in buckets
+            ]
+            return jsonify(history_data), 200
+
+        # Fetch one page of History for the Element
+        history, next_cursor = fetch_history_page(cur, elem_id, value_type, start, end, limit, cursor)
+
+        if not history and cursor is None:
+            return jsonify({"error": "No history found for the specified element"}), 404
+
+        history_data = [{"value": value, "recorded_at": recorded_at.isoformat()} for value, recorded_at in history]
+
+        response = jsonify(history_data)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response, 200
+
+def stream_history(elem_id, value_type, start, end, cursor, limit, format):
+    """
+    Streams history rows as NDJSON (one object per line) or as one JSON array
+    encoded chunk by chunk; the first chunk is sent as soon as it is read.
+    """
+    def rows():
+        # The response outlives the request's connection, so the stream borrows its own
+        with connection() as conn:
+            for chunk in iter_history(conn, elem_id, value_type, start, end, cursor, limit):
+                yield [json.dumps({"value": value, "recorded_at": recorded_at.isoformat()}, default=str)
+                       for value, recorded_at in chunk]
+
+    def generate_ndjson():
+        for chunk in rows():
+            yield "\n".join(chunk) + "\n"
+
+    def generate_json():
+        separator = "["
+        for chunk in rows():
+            yield separator + ",".join(chunk)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    if format == "ndjson":
+        return Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson")
+    return Response(stream_with_context(generate_json()), mimetype="application/json")
 
-        # Fetch Element ID
+@app.route('/aas/<aas_id>/submodel/<submodel_name>/element/<element_key>/aggregate', methods=['GET'])
+def get_submodel_element_aggregate(aas_id, submodel_name, element_key):
+    """
+    Aggregate the history of a specific element into time buckets, computed in the database.
+
+    Query parameters:
+      bucket     bucket width, e.g. 60, 30s, 5m, 1h, 1d (default 1m)
+      agg        comma-separated aggregates: min, max, avg, sum, count, first, last (default avg)
+      from, to   ISO 8601 time range (default: the last AGGREGATE_DEFAULT_RANGE seconds)
+    """
+    try:
+        bucket_seconds = parse_bucket(request.args.get("bucket", "1m"))
+        end = parse_timestamp(request.args["to"]) if "to" in request.args else datetime.now()
+        start = (parse_timestamp(request.args["from"]) if "from" in request.args
+                 else end - timedelta(seconds=AGGREGATE_DEFAULT_RANGE))
+    except ValueError:
+        return jsonify({"error": "Invalid bucket, from or to parameter"}), 400
+    aggregates = [name.strip() for name in request.args.get("agg", "avg").split(",") if name.strip()]
+    unknown = [name for name in aggregates if name not in AGGREGATES]
+    if not aggregates or unknown:
+        return jsonify({"error": f"Unknown aggregates {unknown}, expected any of {sorted(AGGREGATES)}"}), 400
+    if end <= start:
+        return jsonify({"error": "to must be after from"}), 400
+    if (end - start).total_seconds() / bucket_seconds > AGGREGATE_MAX_BUCKETS:
+        return jsonify({"error": f"Range needs more than {AGGREGATE_MAX_BUCKETS} buckets, use a wider bucket"}), 400
+
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Fetch Element ID and type
         cur.execute("""
-        SELECT id FROM submodel_element WHERE submodel_id = %s AND key = %s
-        """, (sm_id, element_key))
+        SELECT e.id, e.value_type FROM submodel_element e
+        JOIN submodel s ON s.id = e.submodel_id
+        WHERE s.aas_id = %s AND s.title = %s AND e.key = %s
+        """, (aas_id, submodel_name, element_key))
         element = cur.fetchone()
         if not element:
             return jsonify({"error": "Element not found in the specified submodel"}), 404
-        elem_id = element[0]
+        elem_id, value_type = element
 
-        # Fetch History for the Element
-        cur.execute("""
-        SELECT value, recorded_at FROM submodel_element_history WHERE submodel_element_id = %s ORDER BY recorded_at DESC
-        """, (elem_id,))
-        history = cur.fetchall()
+        if value_type not in ("integer", "float") and aggregates != ["count"]:
+            return jsonify({"error": f"Element is of type {value_type}, only count can be aggregated"}), 400
 
-        if not history:
-            return jsonify({"error": "No history found for the specified element"}), 404
+        result = fetch_aggregates(cur, elem_id, value_type, start, end, bucket_seconds, aggregates)
+        result.update({
+            "bucket_seconds": bucket_seconds,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+        })
+        return jsonify(result), 200
 
-        history_data = [{"value": value, "recorded_at": recorded_at.isoformat()} for value, recorded_at in history]
+def _list_arg(name):
+    """
+    Collects a query parameter given repeatedly and/or comma-separated.
+    """
+    values = [v.strip() for arg in request.args.getlist(name) for v in arg.split(",")]
+    return [v for v in values if v] or None
 
-        return jsonify(history_data), 200
-    finally:
-        conn.close()
+@app.route('/stream', methods=['GET'])
+def stream_changes():
+    """
+    Stream element changes as Server-Sent Events while the ingest path stores them.
+
+    Query parameters (each repeatable or comma-separated) narrow the stream:
+      aas        AAS IDs
+      submodel   submodel titles
+      key        element keys
+
+    Each "change" event carries {"aas_id", "recorded_at", "values": {submodel: {key: value}}}.
+    A "dropped" event reports events discarded because the client fell behind and a
+    "reset" event that changes may have been missed; clients should re-read then.
+    """
+    subscription = stream_hub.subscribe(_list_arg("aas"), _list_arg("submodel"), _list_arg("key"))
+    if subscription is None:
+        return jsonify({"error": "Too many stream clients, try again later"}), 503
+
+    def generate():
+        reported_drops = 0
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                event = subscription.get(timeout=LIVE_STREAM_HEARTBEAT)
+                if subscription.dropped != reported_drops:
+                    yield f"event: dropped\ndata: {json.dumps({'count': subscription.dropped - reported_drops})}\n\n"
+                    reported_drops = subscription.dropped
+                if event is None:
+                    # Keep-alive; also how a disconnected client is noticed
+                    yield ": keep-alive\n\n"
+                elif event.get("reset"):
+                    yield "event: reset\ndata: {}\n\n"
+                else:
+                    yield f"event: change\ndata: {json.dumps(event)}\n\n"
+        finally:
+            stream_hub.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/aas/snapshot', methods=['GET', 'POST'])
+def get_fleet_snapshot():
+    """
+    Fetch the current values of many AAS shells in one response, built from the
+    live model, or else from a single query.
+
+    Filters (query parameters, repeatable or comma-separated, or the same names
+    as lists in a JSON body for POST, where an empty list selects nothing):
+      aas        AAS IDs (default: all)
+      submodel   submodel titles
+      key        element keys
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({"error": "Expected a JSON object with aas, submodel and key lists"}), 400
+        filters = {name: body.get(name) for name in ("aas", "submodel", "key")}
+        if any(v is not None and not (isinstance(v, list) and all(isinstance(item, str) for item in v))
+               for v in filters.values()):
+            return jsonify({"error": "aas, submodel and key must be lists of strings"}), 400
+    else:
+        filters = {name: _list_arg(name) for name in ("aas", "submodel", "key")}
+
+    if change_listener.is_listening():
+        submodels = set(filters["submodel"]) if filters["submodel"] is not None else None
+        keys = set(filters["key"]) if filters["key"] is not None else None
+        shells = []
+        for shell in live_model.shells(filters["aas"]):
+            selected = {}
+            for title, submodel in shell["submodels"].items():
+                if submodels is not None and title not in submodels:
+                    continue
+                values = {key: value for key, value in submodel["values"].items() if keys is None or key in keys}
+                if values:
+                    selected[title] = values
+            shells.append({"id": shell["id"], "name": shell["name"], "description": shell["description"],
+                           "submodels": selected})
+        return jsonify({"aas": shells}), 200
+
+    conditions = {"aas": "", "submodel": "", "key": ""}
+    params = {}
+    if filters["aas"] is not None:
+        conditions["aas"] = "WHERE a.id = ANY(%(aas)s)"
+        params["aas"] = filters["aas"]
+    if filters["submodel"] is not None:
+        conditions["submodel"] = "AND s.title = ANY(%(submodel)s)"
+        params["submodel"] = filters["submodel"]
+    if filters["key"] is not None:
+        conditions["key"] = "AND e.key = ANY(%(key)s)"
+        params["key"] = filters["key"]
+
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Every selected shell, submodel and element in one set-based query
+        cur.execute(f"""
+        SELECT a.id, a.name, a.description, s.title, e.key, e.value_type, {ELEMENT_VALUE_COLUMNS}
+        FROM aas a
+        LEFT JOIN submodel s ON s.aas_id = a.id {conditions["submodel"]}
+        LEFT JOIN submodel_element e ON e.submodel_id = s.id {conditions["key"]}
+        {conditions["aas"]}
+        ORDER BY a.id, s.title, e.key
+        """, params)
+        rows = cur.fetchall()
+
+    shells = {}
+    for aas_id, name, description, title, key, *value in rows:
+        shell = shells.get(aas_id)
+        if shell is None:
+            shell = shells[aas_id] = {"id": aas_id, "name": name, "description": description, "submodels": {}}
+        if title is not None and key is not None:
+            shell["submodels"].setdefault(title, {})[key] = decode_value(*value)
+
+    return jsonify({"aas": list(shells.values())}), 200
+
+@app.route('/aas/export', methods=['GET'])
+def export_history():
+    """
+    Download history as one Parquet or Arrow file, streamed in cursor batches.
+
+    Query parameters:
+      aas, submodel, key   filters (repeatable or comma-separated)
+      from, to             ISO 8601 range (default: all partitions)
+      format               "parquet" (default) or "arrow"
+    """
+    if export.pa is None:
+        return jsonify({"error": "Export needs pyarrow on the server"}), 501
+    format = request.args.get("format", "parquet")
+    if format not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {sorted(export.FORMATS)}"}), 400
+    try:
+        start = parse_timestamp(request.args["from"]) if "from" in request.args else None
+        end = parse_timestamp(request.args["to"]) if "to" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid from or to parameter"}), 400
+    aas_ids, submodels, keys = _list_arg("aas"), _list_arg("submodel"), _list_arg("key")
+
+    def generate():
+        # The connection is held for the whole download
+        with connection() as conn:
+            first, last = (start, end) if start and end else export.history_range(conn)
+            if first is None:
+                # No history partitions yet: an empty file
+                first = last = datetime.now()
+            yield from export.stream_history(conn, start or first, end or last, aas_ids, submodels, keys, format)
+
+    mimetype = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="history{export.FORMATS[format]}"'})
+
+@app.route('/aas/ingest', methods=['POST'])
+def ingest():
+    """
+    Accept a batch of timestamped samples for any number of robots.
+
+    The body is a JSON list of samples (or {"samples": [...]}), or NDJSON with
+    one sample per line (Content-Type application/x-ndjson). Each sample is
+    validated against its robot type's template; the valid ones are stored
+    in one transaction with their own recorded_at. The response lists an
+    accept/reject result per sample: 200 when all were accepted, 207 when
+    some were rejected and 422 when none were accepted.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/ndjson"):
+        samples = parse_ndjson(request.get_data(as_text=True))
+    else:
+        body = request.get_json(silent=True)
+        samples = body.get("samples") if isinstance(body, dict) else body
+        if not isinstance(samples, list):
+            return jsonify({"error": "Expected a JSON list of samples, {\"samples\": [...]} or NDJSON"}), 400
+
+    if not samples:
+        return jsonify({"error": "No samples"}), 400
+    if len(samples) > INGEST_MAX_SAMPLES:
+        return jsonify({"error": f"At most {INGEST_MAX_SAMPLES} samples per request"}), 413
+
+    with connection() as conn:
+        results = ingest_samples(conn, samples)
+
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    status = 200 if accepted == len(results) else 207 if accepted else 422
+    return jsonify({"accepted": accepted, "rejected": len(results) - accepted, "results": results}), status
 
 @app.route('/aas/list', methods=['GET'])
 def list_all_aas():
     """
     List all registered AASs with their basic details.
     """
-    conn = get_connection()
-    try:
+    with connection() as conn:
         cur = conn.cursor()
 
         # Fetch all AASs
@@ -173,8 +644,15 @@ def list_all_aas():
         ]
 
         return jsonify(aas_list), 200
-    finally:
-        conn.close()
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Counters and latency histograms of this process in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
+    with connection() as conn:
+        require_current_schema(conn)
     app.run(port=5000, debug=True)
@@ -0,0 +1,354 @@
+# history.py
+
+import base64
+import math
+import re
+import uuid
+from datetime import datetime, timedelta
+from config import HISTORY_STREAM_CHUNK_ROWS
+from config import HISTORY_LAYOUT
+from data_logic import VALUE_COLUMNS, decode_value
+from rollups import ROLLUPS, ROLLUP_COLUMNS
+
+# Aggregate functions the aggregation API can compute per time bucket
+AGGREGATES = {
+    "min": "MIN(value_num)",
+    "max": "MAX(value_num)",
+    "avg": "AVG(value_num)",
+    "sum": "SUM(value_num)",
+    "count": "COUNT(*)",
+    "first": "(ARRAY_AGG(value_num ORDER BY recorded_at))[1]",
+    "last": "(ARRAY_AGG(value_num ORDER BY recorded_at DESC))[1]",
+}
+
+# The same aggregates over partial aggregates in the shape of rollup rows, for
+# buckets assembled from rollup rows and raw rows at the edges of the range
+ROLLUP_AGGREGATES = {
+    "min": "MIN(value_min)",
+    "max": "MAX(value_max)",
+    "avg": "SUM(value_sum) / SUM(value_count)::float8",
+    "sum": "SUM(value_sum)",
+    "count": "SUM(value_count)::bigint",
+    "first": "(ARRAY_AGG(value_first ORDER BY first_at))[1]",
+    "last": "(ARRAY_AGG(value_last ORDER BY last_at DESC))[1]",
+}
+
+# Wide history rows unnested into the columns of the narrow layout (one row per
+# element and sample), so the queries below work on either layout. Filters on
+# submodel_element_id and recorded_at are pushed into the join, which keeps
+# partition pruning and the (submodel_id, recorded_at) index in play.
+WIDE_HISTORY_ROWS = """(
+    SELECT h.id, e.id AS submodel_element_id, h.recorded_at,
+           CASE WHEN e.value_type <> 'json' AND jsonb_typeof(h.element_values -> e.key) = 'string'
+                THEN h.element_values ->> e.key END AS value,
+           CASE WHEN e.value_type <> 'json' AND jsonb_typeof(h.element_values -> e.key) = 'number'
+                THEN (h.element_values -> e.key)::float8 END AS value_num,
+           CASE WHEN e.value_type <> 'json' AND jsonb_typeof(h.element_values -> e.key) = 'boolean'
+                THEN (h.element_values -> e.key)::boolean END AS value_bool,
+           CASE WHEN e.value_type = 'json' THEN h.element_values -> e.key END AS value_json
+    FROM submodel_sample_history h
+    JOIN submodel_element e ON e.submodel_id = h.submodel_id AND h.element_values ? e.key
+)"""
+
+# History rows of the configured layout, as a FROM item
+HISTORY_ROWS = WIDE_HISTORY_ROWS if HISTORY_LAYOUT == "wide" else "submodel_element_history"
+
+# Numeric history rows of an element in the shape of rollup rows
+_RAW_AS_ROLLUP = f"""
+    SELECT recorded_at AS t, 1 AS value_count, value_num AS value_min, value_num AS value_max,
+           value_num AS value_sum, value_num AS value_first, recorded_at AS first_at,
+           value_num AS value_last, recorded_at AS last_at
+    FROM {HISTORY_ROWS} AS history
+    WHERE submodel_element_id = %(elem_id)s AND value_num IS NOT NULL
+"""
+
+_BUCKET_PATTERN = re.compile(r"^(\d+)([smhd]?)$")
+_BUCKET_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_timestamp(text):
+    """
+    Parses an ISO 8601 query parameter into the naive local time stored in recorded_at.
+    """
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    ts = datetime.fromisoformat(text)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def parse_bucket(text):
+    """
+    Parses a bucket width such as "30", "30s", "5m", "1h" or "1d" into seconds.
+    """
+    match = _BUCKET_PATTERN.match(text.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket width: {text!r}")
+    return int(match.group(1)) * _BUCKET_UNITS[match.group(2)]
+
+
+def encode_cursor(recorded_at, hist_id):
+    """
+    Encodes the position after a history row as an opaque pagination cursor.
+    """
+    raw = f"{recorded_at.isoformat()}|{hist_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor from encode_cursor into (recorded_at, history id).
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    recorded_at, hist_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+    return datetime.fromisoformat(recorded_at), str(uuid.UUID(hist_id))
+
+
+def _epoch_seconds(ts):
+    delta = ts - _EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def _align(ts, seconds, up=False):
+    """
+    Rounds a timestamp down (or up) to a multiple of `seconds` since the epoch.
+    """
+    whole = _epoch_seconds(ts)
+    aligned = whole - whole % seconds
+    if up and (aligned != whole or ts.microsecond):
+        aligned += seconds
+    return _EPOCH + timedelta(seconds=aligned)
+
+
+def _pick_rollup(width, exact):
+    """
+    Returns the coarsest rollup (an entry of rollups.ROLLUPS) for buckets
+    `width` seconds wide: one whose resolution divides the width if `exact`,
+    else one no coarser than the width. None when only raw rows will do.
+    """
+    for rollup in reversed(ROLLUPS):
+        resolution = rollup[3]
+        if (width % resolution == 0) if exact else (width >= resolution):
+            return rollup
+    return None
+
+
+def _fetch_rollup_buckets(cur, rollup, elem_id, start, end, origin, width, columns):
+    """
+    Aggregates the numeric history of an element in [start, end) into buckets
+    of `width` seconds counted from `origin` (epoch seconds), both multiples
+    of the rollup's resolution.
+
+    Whole rollup buckets inside the range are read from the rollup table and
+    only the partial ones at its edges from the raw history, so the result
+    matches a raw aggregation. `columns` are ROLLUP_AGGREGATES expressions.
+    Returns (bucket start in epoch seconds, *columns) rows, oldest first, or
+    None when the range holds no whole rollup bucket.
+    """
+    _, table, _, resolution = rollup
+    inner_start, inner_end = _align(start, resolution, up=True), _align(end, resolution)
+    if inner_start >= inner_end:
+        return None
+    cur.execute(f"""
+        SELECT (%(origin)s + FLOOR((EXTRACT(EPOCH FROM t) - %(origin)s) / %(width)s) * %(width)s)::bigint AS bucket,
+               {", ".join(columns)}
+        FROM (
+            SELECT bucket AS t, {ROLLUP_COLUMNS} FROM {table}
+            WHERE submodel_element_id = %(elem_id)s AND bucket >= %(inner_start)s AND bucket < %(inner_end)s
+            UNION ALL
+            {_RAW_AS_ROLLUP} AND recorded_at >= %(start)s AND recorded_at < %(inner_start)s
+            UNION ALL
+            {_RAW_AS_ROLLUP} AND recorded_at >= %(inner_end)s AND recorded_at < %(end)s
+        ) AS parts
+        GROUP BY 1
+        ORDER BY 1
+    """, {"elem_id": elem_id, "start": start, "end": end, "inner_start": inner_start, "inner_end": inner_end,
+          "origin": origin, "width": width})
+    return cur.fetchall()
+
+
+def _history_conditions(elem_id, start=None, end=None, cursor=None):
+    """
+    Returns the WHERE conditions and parameters selecting an element's history
+    in [start, end), after the row a pagination cursor points to.
+    """
+    conditions = ["submodel_element_id = %s"]
+    params = [elem_id]
+    if start is not None:
+        conditions.append("recorded_at >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("recorded_at < %s")
+        params.append(end)
+    if cursor is not None:
+        after_recorded_at, after_id = decode_cursor(cursor)
+        # The plain bound lets the planner prune partitions; the row comparison breaks ties
+        conditions.append("recorded_at <= %s AND (recorded_at, id) < (%s, %s::uuid)")
+        params.extend([after_recorded_at, after_recorded_at, after_id])
+    return conditions, params
+
+
+def fetch_history_page(cur, elem_id, value_type, start=None, end=None, limit=1000, cursor=None):
+    """
+    Returns up to `limit` history rows of an element, newest first, and the
+    cursor of the next page (None on the last page).
+
+    `start` is inclusive and `end` exclusive. Pages are keyset-paginated on
+    (recorded_at, id), so deep pages cost the same as the first one. The time
+    bounds go into the query as literals, so only the partitions they touch
+    are scanned.
+    """
+    conditions, params = _history_conditions(elem_id, start, end, cursor)
+
+    # One extra row tells whether another page follows
+    cur.execute(f"""
+        SELECT id, recorded_at, {VALUE_COLUMNS} FROM {HISTORY_ROWS} AS history
+        WHERE {" AND ".join(conditions)}
+        ORDER BY recorded_at DESC, id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return [(decode_value(value_type, *row[2:]), row[1]) for row in rows], next_cursor
+
+
+def iter_history(conn, elem_id, value_type, start=None, end=None, cursor=None, limit=None,
+                 chunk_rows=HISTORY_STREAM_CHUNK_ROWS):
+    """
+    Yields the history rows of an element, newest first, as lists of up to
+    `chunk_rows` (value, recorded_at) pairs.
+
+    The rows come from a named (server-side) cursor, so only one chunk is in
+    memory at a time however long the range is. `limit` caps the total rows
+    (None: all of them); `start`, `end` and `cursor` work as in
+    fetch_history_page.
+    """
+    conditions, params = _history_conditions(elem_id, start, end, cursor)
+    query = f"""
+        SELECT {VALUE_COLUMNS}, recorded_at FROM {HISTORY_ROWS} AS history
+        WHERE {" AND ".join(conditions)}
+        ORDER BY recorded_at DESC, id DESC
+    """
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    with conn.cursor(name="history_stream") as cur:
+        cur.itersize = chunk_rows
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield [(decode_value(value_type, *row[:4]), row[4]) for row in rows]
+    conn.rollback()
+
+
+def fetch_downsampled_history(cur, elem_id, value_type, start=None, end=None, max_points=500):
+    """
+    Reduces the history of an element to at most `max_points` time buckets, newest first.
+
+    Each bucket reports the average of a numeric element's values, or the
+    last value for other value types, together with the bucket start time and
+    the number of raw rows it covers. The reduction runs in the database.
+
+    When the buckets are at least a minute wide, numeric elements are served
+    from the coarsest rollup that fits: the width is rounded up to a multiple
+    of its resolution and buckets start on its boundaries.
+    """
+    if start is None or end is None:
+        conditions = ["submodel_element_id = %s"]
+        params = [elem_id]
+        if start is not None:
+            conditions.append("recorded_at >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("recorded_at < %s")
+            params.append(end)
+        cur.execute(f"""
+            SELECT MIN(recorded_at), MAX(recorded_at) FROM {HISTORY_ROWS} AS history
+            WHERE {" AND ".join(conditions)}
+        """, params)
+        first, last = cur.fetchone()
+        if first is None:
+            return []
+        start = first if start is None else start
+        end = last + timedelta(microseconds=1) if end is None else end
+
+    width = max((end - start).total_seconds() / max_points, 1e-6)
+    numeric = value_type in ("integer", "float")
+    rollup = _pick_rollup(width, exact=False) if numeric else None
+    if rollup is not None:
+        resolution = rollup[3]
+        origin = _align(start, resolution)
+        rollup_width = math.ceil(width / resolution) * resolution
+        while (end - origin).total_seconds() > rollup_width * max_points:
+            rollup_width += resolution
+        rows = _fetch_rollup_buckets(cur, rollup, elem_id, start, end, _epoch_seconds(origin), rollup_width,
+                                     [ROLLUP_AGGREGATES["avg"], ROLLUP_AGGREGATES["count"]])
+        if rows is not None:
+            return [(avg, _EPOCH + timedelta(seconds=bucket), count) for bucket, avg, count in reversed(rows)]
+
+    cur.execute(f"""
+        SELECT LEAST(FLOOR(EXTRACT(EPOCH FROM recorded_at - %(start)s) / %(width)s), %(buckets)s - 1)::int AS bucket,
+               AVG(value_num),
+               (ARRAY_AGG(value ORDER BY recorded_at DESC))[1],
+               (ARRAY_AGG(value_num ORDER BY recorded_at DESC))[1],
+               (ARRAY_AGG(value_bool ORDER BY recorded_at DESC))[1],
+               (ARRAY_AGG(value_json ORDER BY recorded_at DESC))[1],
+               COUNT(*)
+        FROM {HISTORY_ROWS} AS history
+        WHERE submodel_element_id = %(elem_id)s AND recorded_at >= %(start)s AND recorded_at < %(end)s
+        GROUP BY bucket
+        ORDER BY bucket DESC
+    """, {"elem_id": elem_id, "start": start, "end": end, "width": width, "buckets": max_points})
+
+    return [
+        (avg if numeric and avg is not None else decode_value(value_type, *last),
+         start + timedelta(seconds=bucket * width), count)
+        for bucket, avg, *last, count in cur.fetchall()
+    ]
+
+
+def fetch_aggregates(cur, elem_id, value_type, start, end, bucket_seconds, aggregates):
+    """
+    Computes `aggregates` (names from AGGREGATES) of an element per time bucket in the database.
+
+    Buckets are `bucket_seconds` wide and aligned to the epoch, so hourly buckets
+    start on the hour. Returns a dict of parallel arrays: "t" with the bucket
+    start times and one array per aggregate, oldest bucket first; buckets
+    without rows are left out.
+
+    Numeric elements are served from the coarsest rollup whose resolution
+    divides the bucket width, so a month of hourly buckets reads ~720 rollup
+    rows instead of every sample.
+    """
+    rollup = _pick_rollup(bucket_seconds, exact=True) if value_type in ("integer", "float") else None
+    rows = None
+    if rollup is not None:
+        rows = _fetch_rollup_buckets(cur, rollup, elem_id, start, end, 0, bucket_seconds,
+                                     [ROLLUP_AGGREGATES[name] for name in aggregates])
+    if rows is None:
+        columns = ", ".join(AGGREGATES[name] for name in aggregates)
+        cur.execute(f"""
+            SELECT (FLOOR(EXTRACT(EPOCH FROM recorded_at) / %(width)s) * %(width)s)::bigint AS bucket, {columns}
+            FROM {HISTORY_ROWS} AS history
+            WHERE submodel_element_id = %(elem_id)s AND recorded_at >= %(start)s AND recorded_at < %(end)s
+            GROUP BY bucket
+            ORDER BY bucket
+        """, {"elem_id": elem_id, "start": start, "end": end, "width": bucket_seconds})
+        rows = cur.fetchall()
+
+    result = {"t": [(_EPOCH + timedelta(seconds=row[0])).isoformat() for row in rows]}
+    for i, name in enumerate(aggregates, start=1):
+        values = [row[i] for row in rows]
+        if value_type == "integer" and name not in ("avg", "count"):
+            values = [int(v) if v is not None and v.is_integer() else v for v in values]
+        result[name] = values
+    return result
@@ -0,0 +1,134 @@
+# history_layout.py
+#
+# Copies history between the two storage layouts (HISTORY_LAYOUT in config.py):
+#
+#   python history_layout.py status                     rows and sizes of both tables
+#   python history_layout.py convert --to wide          narrow -> wide
+#   python history_layout.py convert --to narrow --delete-source
+#
+# The copy runs one day per transaction, so it can be interrupted and rerun:
+# rows get IDs derived from their source rows and already copied ones are
+# skipped. Switch HISTORY_LAYOUT and restart the writers before converting,
+# so no new rows land in the source table afterwards.
+
+import argparse
+import sys
+from datetime import timedelta
+from data_logic import HISTORY_TABLES
+from history import WIDE_HISTORY_ROWS, parse_timestamp
+from partitions import ensure_partitions, list_partitions, partition_start
+
+# Narrow rows folded into one row per submodel and sample; the narrow layout
+# writes all elements of a sample with the same recorded_at
+_TO_WIDE = """
+    INSERT INTO submodel_sample_history (id, submodel_id, element_values, recorded_at)
+    SELECT md5(e.submodel_id::text || '/' || h.recorded_at::text)::uuid, e.submodel_id,
+           jsonb_object_agg(e.key, CASE
+               WHEN e.value_type = 'json' THEN h.value_json
+               WHEN h.value_num IS NOT NULL AND h.value_num::text NOT IN ('NaN', 'Infinity', '-Infinity')
+                   THEN to_jsonb(h.value_num)
+               WHEN h.value_bool IS NOT NULL THEN to_jsonb(h.value_bool)
+               WHEN h.value_json IS NOT NULL THEN h.value_json
+               ELSE to_jsonb(COALESCE(h.value, h.value_num::text))
+           END),
+           h.recorded_at
+    FROM submodel_element_history h
+    JOIN submodel_element e ON e.id = h.submodel_element_id
+    WHERE h.recorded_at >= %(start)s AND h.recorded_at < %(end)s
+    GROUP BY e.submodel_id, h.recorded_at
+    ON CONFLICT DO NOTHING
+"""
+
+_TO_NARROW = f"""
+    INSERT INTO submodel_element_history (id, submodel_element_id, value, value_num, value_bool, value_json, recorded_at)
+    SELECT md5(w.id::text || '/' || w.submodel_element_id::text)::uuid, w.submodel_element_id,
+           w.value, w.value_num, w.value_bool, w.value_json, w.recorded_at
+    FROM {WIDE_HISTORY_ROWS} AS w
+    WHERE w.recorded_at >= %(start)s AND w.recorded_at < %(end)s
+    ON CONFLICT DO NOTHING
+"""
+
+
+def table_stats(cur, table):
+    """
+    Returns (rows, total bytes, index bytes) of a partitioned table.
+    """
+    cur.execute("""
+        SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint,
+               COALESCE(SUM(pg_total_relation_size(t.relid)), 0)::bigint,
+               COALESCE(SUM(pg_indexes_size(t.relid)), 0)::bigint
+        FROM pg_partition_tree(%s::regclass) t
+        JOIN pg_class c ON c.oid = t.relid
+        WHERE t.isleaf
+    """, (table,))
+    return cur.fetchone()
+
+
+def convert(conn, to, start=None, end=None, delete_source=False):
+    """
+    Copies history in [start, end) (default: everything) into the `to` layout,
+    one day per transaction. With `delete_source` each copied day is deleted
+    from the other table in the same transaction. Returns the rows copied.
+    """
+    if to not in HISTORY_TABLES:
+        raise ValueError(f"Unknown layout: {to!r} (expected one of {sorted(HISTORY_TABLES)})")
+    source = HISTORY_TABLES["narrow" if to == "wide" else "wide"]
+    target = HISTORY_TABLES[to]
+
+    with conn.cursor() as cur:
+        partitions = list_partitions(cur, source)
+    conn.rollback()
+    if not partitions:
+        return 0
+    start = start or partitions[0][1]
+    end = end or partitions[-1][2]
+
+    copied = 0
+    day = partition_start(start, "daily")
+    while day < end:
+        day_start, day_end = max(day, start), min(day + timedelta(days=1), end)
+        with conn.cursor() as cur:
+            ensure_partitions(cur, target, start=day_start, end=day_end)
+            cur.execute(_TO_WIDE if to == "wide" else _TO_NARROW, {"start": day_start, "end": day_end})
+            rows = cur.rowcount
+            if delete_source:
+                cur.execute(f"DELETE FROM {source} WHERE recorded_at >= %s AND recorded_at < %s", (day_start, day_end))
+        conn.commit()
+        if rows:
+            print(f"{day_start:%Y-%m-%d}: {rows} rows")
+        copied += rows
+        day += timedelta(days=1)
+    return copied
+
+
+def main():
+    from db_setup import get_connection
+
+    parser = argparse.ArgumentParser(description="Copy element history between the narrow and wide layouts.")
+    parser.add_argument("command", choices=["status", "convert"])
+    parser.add_argument("--to", choices=sorted(HISTORY_TABLES), help="target layout of convert")
+    parser.add_argument("--from", dest="start", type=parse_timestamp, help="ISO 8601 start, inclusive")
+    parser.add_argument("--until", dest="end", type=parse_timestamp, help="ISO 8601 end, exclusive")
+    parser.add_argument("--delete-source", action="store_true", help="delete copied rows from the source table")
+    args = parser.parse_args()
+    if args.command == "convert" and args.to is None:
+        parser.error("convert needs --to")
+
+    conn = get_connection()
+    try:
+        if args.command == "status":
+            with conn.cursor() as cur:
+                for layout, table in sorted(HISTORY_TABLES.items()):
+                    rows, total, indexes = table_stats(cur, table)
+                    print(f"{layout:6} {table}: ~{rows} rows, {total / 2**20:.1f} MiB ({indexes / 2**20:.1f} MiB indexes)")
+            return 0
+
+        copied = convert(conn, args.to, args.start, args.end, args.delete_source)
+        print(f"Copied {copied} rows into the {args.to} layout")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# ingest.py
+#
+# Samples pushed by edge gateways over HTTP (POST /aas/ingest). A sample is the
+# same flat dict the generators produce, plus the robot type and the robot's
+# own timestamp:
+#
+#   {"type": "mir", "serial_number": "SN-MIR1234", "robot_name": "MiR-100",
+#    "recorded_at": "2024-05-01T12:00:00.250Z", "battery_percentage": 81.5, ...}
+#
+# Every sample is validated against its submodel template on its own; the
+# accepted ones are stored together in one transaction.
+
+import json
+import math
+from datetime import datetime, timedelta
+from config import MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE
+from config import HISTORY_RETENTION_DAYS, INGEST_MAX_CLOCK_SKEW
+from data_logic import ensure_aas_structure_mir, ensure_aas_structure_kuka, store_samples, robot_types, HISTORY_TABLE
+from history import parse_timestamp
+from partitions import ensure_partitions
+
+ROBOT_TYPES = {
+    "mir": (MIR_SUBMODEL_TEMPLATE, ensure_aas_structure_mir),
+    "kuka": (KUKA_SUBMODEL_TEMPLATE, ensure_aas_structure_kuka),
+}
+
+# Fields of a sample that are not element values. A gateway may set sample_id
+# to make retries idempotent: history rows of the same sample_id are stored once.
+SAMPLE_FIELDS = ("type", "serial_number", "robot_name", "recorded_at", "sample_id")
+
+
+def parse_ndjson(text):
+    """
+    Parses newline-delimited JSON; returns one decoded object per non-empty
+    line, or a ValueError in place of a line that is not valid JSON.
+    """
+    samples = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            samples.append(json.loads(line))
+        except ValueError as e:
+            samples.append(ValueError(f"Invalid JSON: {e}"))
+    return samples
+
+
+def _value_error(value, value_type):
+    """
+    Returns why a value does not fit its declared type, or None if it does.
+    NaN and infinities are refused: the read routes could not return them as JSON.
+    """
+    if value is None or value_type is None:
+        return None
+    if value_type == "json":
+        try:
+            json.dumps(value, allow_nan=False)
+        except ValueError:
+            return "must not contain NaN or Infinity"
+        return None
+    if value_type == "string":
+        return None if isinstance(value, str) else "must be of type string"
+    if value_type == "boolean":
+        return None if isinstance(value, bool) else "must be of type boolean"
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return f"must be of type {value_type}"
+    try:
+        finite = math.isfinite(value)
+    except OverflowError:
+        # An integer too big for a float
+        finite = False
+    if not finite:
+        return "must be a finite number"
+    if value_type == "integer" and not float(value).is_integer():
+        return f"must be of type {value_type}"
+    return None
+
+
+def validate_sample(sample, now=None):
+    """
+    Checks one pushed sample against its robot type's template.
+
+    Returns (data, submodel_template, recorded_at, ensure_structure) for a
+    valid sample; raises ValueError with every problem found otherwise.
+    """
+    if isinstance(sample, ValueError):
+        raise sample
+    if not isinstance(sample, dict):
+        raise ValueError("Sample must be a JSON object")
+
+    errors = []
+    robot_type = ROBOT_TYPES.get(sample.get("type"))
+    if robot_type is None:
+        errors.append(f"Unknown robot type {sample.get('type')!r} (expected one of {sorted(ROBOT_TYPES)})")
+    for field in ("serial_number", "robot_name"):
+        if not isinstance(sample.get(field), str) or not sample[field]:
+            errors.append(f"{field} must be a non-empty string")
+    if "sample_id" in sample and (not isinstance(sample["sample_id"], str) or not sample["sample_id"]):
+        errors.append("sample_id must be a non-empty string")
+
+    recorded_at = None
+    if not isinstance(sample.get("recorded_at"), str):
+        errors.append("recorded_at must be an ISO 8601 timestamp")
+    else:
+        try:
+            recorded_at = parse_timestamp(sample["recorded_at"])
+        except ValueError:
+            errors.append(f"Invalid recorded_at: {sample['recorded_at']!r}")
+
+    if recorded_at is not None:
+        now = now or datetime.now()
+        if recorded_at > now + timedelta(seconds=INGEST_MAX_CLOCK_SKEW):
+            errors.append("recorded_at is in the future")
+        elif HISTORY_RETENTION_DAYS is not None and recorded_at < now - timedelta(days=HISTORY_RETENTION_DAYS):
+            errors.append("recorded_at is older than the history retention")
+
+    if robot_type is not None:
+        template = robot_type[0]
+        value_types = {k: t for keys in template.values() for k, t in keys.items()}
+        values = {k: v for k, v in sample.items() if k not in SAMPLE_FIELDS}
+        if not values:
+            errors.append("Sample has no values")
+        for k, v in values.items():
+            if k not in value_types:
+                errors.append(f"Unknown key {k!r}")
+                continue
+            error = _value_error(v, value_types[k])
+            if error is not None:
+                errors.append(f"{k} {error}")
+
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    template, ensure_structure = robot_type
+    data = {k: v for k, v in sample.items() if k not in ("type", "recorded_at")}
+    return data, template, recorded_at, ensure_structure
+
+
+def robot_type_errors(conn, samples):
+    """
+    Checks (robot_type, serial_number) pairs against the robot type each
+    serial number was provisioned as, or first appears as in the list.
+
+    Returns one error message or None per pair, in order.
+    """
+    known = robot_types(conn, {serial for _, serial in samples})
+    errors = []
+    for robot_type, serial in samples:
+        known_type = known.setdefault(serial, robot_type)
+        errors.append(None if known_type == robot_type else f"{serial} is a {known_type} robot, not {robot_type}")
+    return errors
+
+
+def ingest_samples(conn, samples, now=None):
+    """
+    Validates pushed samples and stores the valid ones in one transaction.
+
+    A sample whose type differs from the one its serial number was
+    provisioned as is rejected. Returns one result per sample, in order:
+    {"index", "status": "accepted"} or {"index", "status": "rejected", "error"}.
+    """
+    results = {}
+    valid = []
+    for index, sample in enumerate(samples):
+        try:
+            valid.append((index, sample["type"], validate_sample(sample, now)))
+        except ValueError as e:
+            results[index] = {"index": index, "status": "rejected", "error": str(e)}
+
+    accepted = []
+    if valid:
+        errors = robot_type_errors(conn, [(robot_type, entry[0]["serial_number"]) for _, robot_type, entry in valid])
+        for (index, _, entry), error in zip(valid, errors):
+            if error is not None:
+                results[index] = {"index": index, "status": "rejected", "error": error}
+            else:
+                results[index] = {"index": index, "status": "accepted"}
+                accepted.append(entry)
+
+    if accepted:
+        store_batch(conn, accepted)
+    return [results[index] for index in range(len(samples))]
+
+
+def store_batch(conn, samples, ensured=None):
+    """
+    Stores (data, submodel_template, recorded_at, ensure_structure) samples in one transaction.
+
+    Missing AAS structure is created first (committed on its own, as it is
+    idempotent); serial numbers in the `ensured` set are skipped and the
+    set is updated. The samples themselves are written by a single
+    store_samples call, oldest first, so the newest value of each element
+    ends up as its current value.
+    """
+    ensured = set() if ensured is None else ensured
+    for data, _, _, ensure_structure in samples:
+        if data["serial_number"] not in ensured:
+            ensure_structure(conn, data)
+            ensured.add(data["serial_number"])
+
+    batch = sorted(((data, template, recorded_at) for data, template, recorded_at, _ in samples),
+                   key=lambda s: s[2])
+    try:
+        # Samples may be older than the partitions maintenance made
+        with conn.cursor() as cur:
+            ensure_partitions(cur, HISTORY_TABLE, start=batch[0][2])
+        store_samples(conn, batch)
+    except Exception:
+        conn.rollback()
+        raise
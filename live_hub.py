@@ -0,0 +1,103 @@
+# live_hub.py
+
+import threading
+from collections import deque
+from config import LIVE_STREAM_QUEUE_SIZE, LIVE_STREAM_MAX_CLIENTS
+
+
+class Subscription:
+    """
+    One streaming client: a filter and a bounded queue of matching change events.
+
+    When the client falls behind, the oldest queued events are dropped and
+    counted in `dropped`, so a slow client never holds back the others.
+    """
+
+    def __init__(self, aas_ids=None, submodels=None, keys=None, max_queue=LIVE_STREAM_QUEUE_SIZE):
+        self.aas_ids = set(aas_ids) if aas_ids else None
+        self.submodels = set(submodels) if submodels else None
+        self.keys = set(keys) if keys else None
+        self.dropped = 0
+        self._queue = deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+
+    def filter(self, event):
+        """
+        Returns the part of `event` this subscription asked for, or None.
+        """
+        if event.get("reset"):
+            return event
+        if self.aas_ids is not None and event.get("aas_id") not in self.aas_ids:
+            return None
+        if "values" not in event or (self.submodels is None and self.keys is None):
+            return event
+
+        values = {}
+        for submodel, elements in event["values"].items():
+            if self.submodels is not None and submodel not in self.submodels:
+                continue
+            if self.keys is not None:
+                elements = {k: v for k, v in elements.items() if k in self.keys}
+            if elements:
+                values[submodel] = elements
+        if not values:
+            return None
+        return dict(event, values=values)
+
+    def put(self, event):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the next event, or None if none arrived within `timeout` seconds.
+        """
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            return self._queue.popleft() if self._queue else None
+
+
+class StreamHub:
+    """
+    In-process publish/subscribe hub between the change feed and streaming clients.
+
+    publish() is called once per change event and fans it out to every
+    subscription whose filter matches, so the cost of N clients is N queue
+    appends rather than N database polls.
+    """
+
+    def __init__(self, max_clients=LIVE_STREAM_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, aas_ids=None, submodels=None, keys=None):
+        """
+        Registers a client; returns None when max_clients are already connected.
+        """
+        subscription = Subscription(aas_ids, submodels, keys)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            filtered = subscription.filter(event)
+            if filtered is not None:
+                subscription.put(filtered)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscriptions)
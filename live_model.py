@@ -0,0 +1,209 @@
+# live_model.py
+#
+# In-memory current values of every AAS shell for the read routes of the API.
+# The ingest path announces what it stores through the change feed (with the
+# AAS and submodel versions its commit left behind), and the API process's
+# ChangeListener applies each event to the model as it arrives, so current
+# values, submodels and single elements are answered without a query.
+
+import threading
+from datetime import datetime
+from data_logic import VALUE_COLUMNS, decode_value
+import metrics
+
+# Value columns of submodel_element aliased as "e"
+_ELEMENT_VALUE_COLUMNS = ", ".join("e." + column for column in VALUE_COLUMNS.split(", "))
+
+
+def _version(version, updated_at):
+    return version, datetime.fromisoformat(updated_at)
+
+
+class LiveModel:
+    """
+    Snapshots of AAS shells, loaded from the database on first use and then
+    kept current by change events.
+
+    A snapshot is
+      {"id", "name", "description", "version", "updated_at",
+       "submodels": {title: {"id", "semantic_id", "version", "updated_at", "values": {key: value}}}}
+    and is never modified: apply() copies the parts an event changes into a
+    new snapshot and swaps it in under the lock, so readers take the current
+    one without locking and never see an event half applied. Versions are the
+    database's; they are None between the events of one commit, as only the
+    last event of an AAS carries them.
+
+    Events the model cannot apply (new structure, truncated values) drop the
+    shell so the next read loads it again; reset() drops everything. Only
+    trust the model while the change listener feeding it is listening.
+    `connection` is a context manager factory such as db_setup.connection.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._shells = {}  # aas_id -> snapshot, or None when it has to be loaded again
+        self._complete = False  # every existing AAS is a key of _shells
+        self._generations = {}  # aas_id -> events applied, to discard loads that raced one
+        self._resets = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "dropped": 0}
+        metrics.register_collector(self._metrics)
+
+    def get(self, aas_id):
+        """
+        Returns the snapshot of an AAS, or None if it does not exist.
+        """
+        shells = self.shells([aas_id])
+        return shells[0] if shells else None
+
+    def shells(self, aas_ids=None):
+        """
+        Returns the snapshots of the given AAS IDs (default: all existing), sorted by ID.
+        Shells that are not held are loaded together in one round trip.
+        """
+        if aas_ids is None:
+            if not self._complete:
+                self._load_all()
+            with self._lock:
+                aas_ids = list(self._shells)
+        aas_ids = sorted(set(aas_ids))
+
+        held = self._shells
+        found = {}
+        missing = []
+        for aas_id in aas_ids:
+            shell = held.get(aas_id)
+            if shell is not None:
+                found[aas_id] = shell
+            elif not (self._complete and aas_id not in held):
+                missing.append(aas_id)
+        self._stats["hits"] += len(aas_ids) - len(missing)
+        if missing:
+            found.update(self._load_missing(missing))
+        return [found[aas_id] for aas_id in aas_ids if aas_id in found]
+
+    def apply(self, event):
+        """
+        Applies a change event of the change feed (ChangeListener subscriber).
+        """
+        aas_id = event.get("aas_id")
+        if aas_id is None:
+            return
+        with self._lock:
+            self._generations[aas_id] = self._generations.get(aas_id, 0) + 1
+            shell = self._shells.get(aas_id)
+            if shell is not None:
+                shell = self._updated(shell, event)
+                if shell is None:
+                    self._stats["dropped"] += 1
+            if shell is not None or aas_id in self._shells or self._complete:
+                # An AAS unknown to a complete model is new and loaded when first read
+                self._shells[aas_id] = shell
+
+    def reset(self):
+        """
+        Drops every snapshot, e.g. when change events may have been missed.
+        """
+        with self._lock:
+            self._resets += 1
+            self._shells = {}
+            self._complete = False
+
+    def _updated(self, shell, event):
+        """
+        Returns a copy of `shell` with the event applied, or None if it has to be loaded again.
+        """
+        # Events without values announce new structure; truncated ones lost their values
+        if "values" not in event or event.get("truncated"):
+            return None
+        submodels = dict(shell["submodels"])
+        for title, values in event["values"].items():
+            submodel = submodels.get(title)
+            if submodel is None or any(key not in submodel["values"] for key in values):
+                return None
+            submodels[title] = dict(submodel, values={**submodel["values"], **values}, version=None, updated_at=None)
+        for title, (version, updated_at) in event.get("submodel_versions", {}).items():
+            if title in submodels:
+                version, updated_at = _version(version, updated_at)
+                submodels[title] = dict(submodels[title], version=version, updated_at=updated_at)
+
+        version, updated_at = _version(event["version"], event["updated_at"]) if "version" in event else (None, None)
+        return dict(shell, submodels=submodels, version=version, updated_at=updated_at)
+
+    def _load_missing(self, aas_ids):
+        with self._lock:
+            generations = {aas_id: (self._resets, self._generations.get(aas_id, 0)) for aas_id in aas_ids}
+        shells = self._load(aas_ids)
+        with self._lock:
+            for aas_id, shell in shells.items():
+                # A snapshot read before an event arrived would lack that event's changes
+                if generations[aas_id] == (self._resets, self._generations.get(aas_id, 0)):
+                    self._shells[aas_id] = shell
+        return shells
+
+    def _load_all(self):
+        with self._lock:
+            resets = self._resets
+            generations = dict(self._generations)
+        shells = self._load()
+        with self._lock:
+            if resets != self._resets:
+                return
+            changed = {aas_id for aas_id, generation in self._generations.items()
+                       if generation != generations.get(aas_id, 0)}
+            for aas_id, shell in shells.items():
+                if aas_id not in changed:
+                    self._shells[aas_id] = shell
+            # Shells an event arrived for during the load, new ones included, are
+            # kept if held and otherwise loaded when first read
+            for aas_id in changed:
+                self._shells.setdefault(aas_id, None)
+            self._complete = True
+
+    def _load(self, aas_ids=None):
+        """
+        Reads snapshots of the given AAS IDs (default: all) in one round trip.
+        """
+        self._stats["loads"] += 1
+        condition = "WHERE a.id = ANY(%(aas)s)" if aas_ids is not None else ""
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+            SELECT a.id, a.name, a.description, a.version, a.updated_at,
+                   s.id, s.title, s.semantic_id, s.version, s.updated_at, e.key, e.value_type, {_ELEMENT_VALUE_COLUMNS}
+            FROM aas a
+            LEFT JOIN submodel s ON s.aas_id = a.id
+            LEFT JOIN submodel_element e ON e.submodel_id = s.id
+            {condition}
+            ORDER BY a.id, s.created_at, s.title, e.created_at, e.key
+            """, {"aas": aas_ids})
+            rows = cur.fetchall()
+
+        shells = {}
+        for aas_id, name, description, version, updated_at, sm_id, title, semantic_id, sm_version, sm_updated_at, \
+                key, *value in rows:
+            shell = shells.get(aas_id)
+            if shell is None:
+                shell = shells[aas_id] = {"id": aas_id, "name": name, "description": description,
+                                          "version": version, "updated_at": updated_at, "submodels": {}}
+            if sm_id is None:
+                continue
+            submodel = shell["submodels"].get(title)
+            if submodel is None:
+                submodel = shell["submodels"][title] = {"id": str(sm_id), "semantic_id": semantic_id,
+                                                        "version": sm_version, "updated_at": sm_updated_at,
+                                                        "values": {}}
+            if key is not None:
+                submodel["values"][key] = decode_value(*value)
+        return shells
+
+    def _metrics(self):
+        shells = self._shells
+        return [
+            ("aas_live_model_shells", "gauge", "AAS shells held by the live model.",
+             sum(1 for shell in shells.values() if shell is not None)),
+            ("aas_live_model_hits_total", "counter", "Reads answered from the live model.", self._stats["hits"]),
+            ("aas_live_model_loads_total", "counter", "Database reads of the live model.", self._stats["loads"]),
+            ("aas_live_model_dropped_total", "counter", "Shells dropped by events the live model could not apply.",
+             self._stats["dropped"]),
+        ]
@@ -0,0 +1,248 @@
+# metrics.py
+#
+# In-process counters and latency histograms for the ingest path and the API,
+# rendered in the Prometheus text format (the Flask app serves them on
+# /metrics, run-all.py on METRICS_PORT).
+#
+#   with stage("commit"):       times a block and counts the SQL statements sent in it
+#   @timed("ensure")            the same for a whole function
+#
+# Statements are counted by InstrumentedCursor, which db_setup installs on
+# every connection while metrics are enabled. With METRICS_ENABLED = False
+# stage() hands out a shared no-op context manager and nothing is counted.
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from psycopg2 import extensions
+from config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS
+
+enabled = METRICS_ENABLED
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+_local = threading.local()
+_NULL_STAGE = nullcontext()
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram of observed values (seconds, statement counts, ...), optionally split by labels.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [count per bucket..., count above the last, sum]
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def observe(self, value, **labels):
+        if not enabled:
+            return
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, ("le", _format_number(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def register_collector(collect):
+    """
+    Adds a function called on every render; it returns (name, type, help, value)
+    tuples for values kept elsewhere, such as the connection pool counters.
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in collectors:
+        try:
+            samples = list(collect())
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, help, value in samples:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_format_number(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# Ingest and API metrics
+stage_seconds = Histogram("aas_stage_seconds", "Time spent per stage of the ingest path.", ["stage"])
+stage_statements = Counter("aas_stage_statements_total",
+                           "SQL statements sent per stage (stages nest, e.g. lookup inside store).", ["stage"])
+ingested_samples = Counter("aas_ingest_samples_total", "Data points passed to store_samples.")
+http_request_seconds = Histogram("aas_http_request_seconds", "Time to handle an API request.",
+                                 ["route", "method", "status"])
+http_statements = Counter("aas_http_statements_total", "SQL statements sent while handling API requests.",
+                          ["route"])
+robot_poll_seconds = Histogram("aas_robot_poll_seconds", "Time to fetch a robot's status over its REST API.",
+                             ["outcome"])
+
+
+class InstrumentedCursor(extensions.cursor):
+    """
+    Cursor that counts the statements sent through it on the current thread.
+    """
+
+    def execute(self, query, vars=None):
+        _local.statements = getattr(_local, "statements", 0) + 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        _local.statements = getattr(_local, "statements", 0) + 1
+        return super().executemany(query, vars_list)
+
+
+def statement_count():
+    """
+    Returns the number of statements sent by this thread so far.
+    """
+    return getattr(_local, "statements", 0)
+
+
+class _Stage:
+    __slots__ = ("name", "started", "statements")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.statements = statement_count()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stage_seconds.observe(time.perf_counter() - self.started, stage=self.name)
+        stage_statements.inc(statement_count() - self.statements, stage=self.name)
+        return False
+
+
+def stage(name):
+    """
+    Context manager that records the duration and statement count of a block.
+    """
+    if not enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed(name):
+    """
+    Decorator form of stage().
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host=""):
+    """
+    Serves render() on http://host:port/ from a background thread, for
+    processes without a web app such as run-all.py. Returns the server;
+    call shutdown() on it to stop.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
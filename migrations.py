@@ -0,0 +1,389 @@
+# migrations.py
+#
+# Versioned schema migrations for the AAS database. Importing this module does
+# not touch the database; apply pending migrations explicitly with
+#
+#   python migrations.py            (same as: python migrations.py upgrade)
+#   python migrations.py status
+
+import argparse
+import sys
+from config import MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE
+from partitions import ensure_partitions, list_partitions
+from rollups import ROLLUPS, rebuild_rollups
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Registers a function(cur) as the migration to schema `version`.
+    """
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+@migration(1, "Base AAS tables")
+def create_base_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS aas (
+        id VARCHAR(255) PRIMARY KEY,
+        name VARCHAR(255),
+        description TEXT,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS submodel (
+        id UUID PRIMARY KEY,
+        aas_id VARCHAR(255) REFERENCES aas(id),
+        title VARCHAR(255),
+        semantic_id VARCHAR(255),
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS submodel_element (
+        id UUID PRIMARY KEY,
+        submodel_id UUID REFERENCES submodel(id),
+        key VARCHAR(255),
+        value TEXT,
+        value_type VARCHAR(50),
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS submodel_element_history (
+        id UUID PRIMARY KEY,
+        submodel_element_id UUID REFERENCES submodel_element(id),
+        value TEXT,
+        recorded_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+
+@migration(2, "Unique submodel/element names and history lookup index")
+def add_unique_constraints_and_indexes(cur):
+    # Merge duplicate submodels into the oldest one of each (aas_id, title)
+    cur.execute("""
+    CREATE TEMP TABLE submodel_duplicates ON COMMIT DROP AS
+    SELECT id, FIRST_VALUE(id) OVER (PARTITION BY aas_id, title ORDER BY created_at, id) AS keep_id
+    FROM submodel
+    WHERE aas_id IS NOT NULL AND title IS NOT NULL;
+    """)
+    cur.execute("DELETE FROM submodel_duplicates WHERE id = keep_id")
+    cur.execute("""
+    UPDATE submodel_element e SET submodel_id = d.keep_id
+    FROM submodel_duplicates d WHERE e.submodel_id = d.id
+    """)
+    cur.execute("DELETE FROM submodel s USING submodel_duplicates d WHERE s.id = d.id")
+
+    # Merge duplicate elements, moving their history to the surviving element
+    cur.execute("""
+    CREATE TEMP TABLE element_duplicates ON COMMIT DROP AS
+    SELECT id, FIRST_VALUE(id) OVER (PARTITION BY submodel_id, key ORDER BY created_at, id) AS keep_id
+    FROM submodel_element
+    WHERE submodel_id IS NOT NULL AND key IS NOT NULL;
+    """)
+    cur.execute("DELETE FROM element_duplicates WHERE id = keep_id")
+    cur.execute("""
+    UPDATE submodel_element_history h SET submodel_element_id = d.keep_id
+    FROM element_duplicates d WHERE h.submodel_element_id = d.id
+    """)
+    cur.execute("DELETE FROM submodel_element e USING element_duplicates d WHERE e.id = d.id")
+
+    # The unique indexes carry the id, so ID lookups by name are index-only scans
+    cur.execute("""
+    ALTER TABLE submodel
+        ADD CONSTRAINT submodel_aas_id_title_key UNIQUE (aas_id, title) INCLUDE (id)
+    """)
+    cur.execute("""
+    ALTER TABLE submodel_element
+        ADD CONSTRAINT submodel_element_submodel_id_key_key UNIQUE (submodel_id, key) INCLUDE (id)
+    """)
+    cur.execute("""
+    CREATE INDEX submodel_element_history_element_recorded_at_idx
+        ON submodel_element_history (submodel_element_id, recorded_at DESC, id DESC) INCLUDE (value)
+    """)
+
+
+@migration(3, "Partition submodel_element_history by recorded_at")
+def partition_history(cur):
+    cur.execute("ALTER TABLE submodel_element_history RENAME TO submodel_element_history_unpartitioned")
+    cur.execute("ALTER INDEX submodel_element_history_pkey RENAME TO submodel_element_history_unpartitioned_pkey")
+    cur.execute("DROP INDEX submodel_element_history_element_recorded_at_idx")
+
+    # The partition key has to be part of the primary key
+    cur.execute("""
+    CREATE TABLE submodel_element_history (
+        id UUID NOT NULL,
+        submodel_element_id UUID REFERENCES submodel_element(id),
+        value TEXT,
+        recorded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, recorded_at)
+    ) PARTITION BY RANGE (recorded_at);
+    """)
+    cur.execute("""
+    CREATE INDEX submodel_element_history_element_recorded_at_idx
+        ON submodel_element_history (submodel_element_id, recorded_at DESC, id DESC) INCLUDE (value)
+    """)
+
+    # Partitions for the existing rows plus the usual ones ahead of now
+    cur.execute("SELECT MIN(recorded_at) FROM submodel_element_history_unpartitioned")
+    oldest = cur.fetchone()[0]
+    ensure_partitions(cur, "submodel_element_history", start=oldest)
+
+    cur.execute("""
+    INSERT INTO submodel_element_history (id, submodel_element_id, value, recorded_at)
+    SELECT id, submodel_element_id, value, COALESCE(recorded_at, NOW())
+    FROM submodel_element_history_unpartitioned
+    """)
+    cur.execute("DROP TABLE submodel_element_history_unpartitioned")
+
+
+@migration(4, "Typed value columns for elements and history")
+def add_typed_value_columns(cur):
+    for table in ("submodel_element", "submodel_element_history"):
+        cur.execute(f"""
+        ALTER TABLE {table}
+            ADD COLUMN value_num DOUBLE PRECISION,
+            ADD COLUMN value_bool BOOLEAN,
+            ADD COLUMN value_json JSONB
+        """)
+
+    # Value types now come from the templates instead of a blanket "string"
+    for template in (MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE):
+        for title, keys in template.items():
+            for key, value_type in keys.items():
+                cur.execute("""
+                UPDATE submodel_element e SET value_type = %s
+                FROM submodel s
+                WHERE e.submodel_id = s.id AND s.title = %s AND e.key = %s
+                """, (value_type, title, key))
+
+    # Move convertible text values into their typed column; anything else stays text
+    numeric = r'^[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?$'
+    cur.execute("""
+    UPDATE submodel_element SET value_num = value::float8, value = NULL
+    WHERE value_type IN ('integer', 'float') AND value ~ %s
+    """, (numeric,))
+    cur.execute("""
+    UPDATE submodel_element SET value_bool = lower(value) = 'true', value = NULL
+    WHERE value_type = 'boolean' AND lower(value) IN ('true', 'false')
+    """)
+    cur.execute("""
+    UPDATE submodel_element_history h SET value_num = h.value::float8, value = NULL
+    FROM submodel_element e
+    WHERE h.submodel_element_id = e.id AND e.value_type IN ('integer', 'float') AND h.value ~ %s
+    """, (numeric,))
+    cur.execute("""
+    UPDATE submodel_element_history h SET value_bool = lower(h.value) = 'true', value = NULL
+    FROM submodel_element e
+    WHERE h.submodel_element_id = e.id AND e.value_type = 'boolean' AND lower(h.value) IN ('true', 'false')
+    """)
+
+    cur.execute("DROP INDEX submodel_element_history_element_recorded_at_idx")
+    cur.execute("""
+    CREATE INDEX submodel_element_history_element_recorded_at_idx
+        ON submodel_element_history (submodel_element_id, recorded_at DESC, id DESC)
+        INCLUDE (value_num, value_bool, value)
+    """)
+
+
+@migration(5, "Change versions of AAS and submodels for conditional GET")
+def add_change_versions(cur):
+    for table in ("aas", "submodel"):
+        cur.execute(f"""
+        ALTER TABLE {table}
+            ADD COLUMN version BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        """)
+
+
+@migration(6, "Wide per-sample history table")
+def add_sample_history(cur):
+    # One row per submodel and sample; element_values maps element keys to values
+    cur.execute("""
+    CREATE TABLE submodel_sample_history (
+        id UUID NOT NULL,
+        submodel_id UUID REFERENCES submodel(id),
+        element_values JSONB NOT NULL,
+        recorded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, recorded_at)
+    ) PARTITION BY RANGE (recorded_at);
+    """)
+    cur.execute("""
+    CREATE INDEX submodel_sample_history_submodel_recorded_at_idx
+        ON submodel_sample_history (submodel_id, recorded_at DESC, id DESC)
+    """)
+    ensure_partitions(cur, "submodel_sample_history")
+
+
+@migration(7, "Per-minute and per-hour history rollups")
+def add_history_rollups(cur):
+    from data_logic import HISTORY_TABLE
+    from history import HISTORY_ROWS
+
+    for _, table, _, _ in ROLLUPS:
+        cur.execute(f"""
+        CREATE TABLE {table} (
+            submodel_element_id UUID NOT NULL REFERENCES submodel_element(id),
+            bucket TIMESTAMP NOT NULL,
+            value_count BIGINT NOT NULL,
+            value_min DOUBLE PRECISION,
+            value_max DOUBLE PRECISION,
+            value_sum DOUBLE PRECISION,
+            value_first DOUBLE PRECISION,
+            first_at TIMESTAMP,
+            value_last DOUBLE PRECISION,
+            last_at TIMESTAMP,
+            PRIMARY KEY (submodel_element_id, bucket)
+        )
+        """)
+
+    # Roll up the history stored so far; new rows are rolled up as they are written
+    partitions = list_partitions(cur, HISTORY_TABLE)
+    if partitions:
+        rebuild_rollups(cur, HISTORY_ROWS, partitions[0][1], partitions[-1][2])
+
+
+@migration(8, "Template hash of provisioned AAS structures")
+def add_template_hash(cur):
+    # NULL until the structure is next ensured, which then records the hash
+    cur.execute("ALTER TABLE aas ADD COLUMN template_hash TEXT")
+
+
+@migration(9, "Recorded time of current element values")
+def add_value_recorded_at(cur):
+    # NULL until the element's value is next stored
+    cur.execute("ALTER TABLE submodel_element ADD COLUMN value_recorded_at TIMESTAMP")
+
+
+@migration(10, "Robot type of each AAS")
+def add_robot_type(cur):
+    cur.execute("ALTER TABLE aas ADD COLUMN robot_type TEXT")
+
+    # Existing shells are told apart by the submodel titles only one template has;
+    # any left NULL take the type of the next ensure call
+    for robot_type, template, other in (("mir", MIR_SUBMODEL_TEMPLATE, KUKA_SUBMODEL_TEMPLATE),
+                                        ("kuka", KUKA_SUBMODEL_TEMPLATE, MIR_SUBMODEL_TEMPLATE)):
+        cur.execute("""
+        UPDATE aas a SET robot_type = %s
+        WHERE robot_type IS NULL
+          AND EXISTS (SELECT 1 FROM submodel s WHERE s.aas_id = a.id AND s.title = ANY(%s))
+        """, (robot_type, sorted(set(template) - set(other))))
+
+
+def _ensure_version_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+    conn.commit()
+
+
+def current_version(conn):
+    """
+    Returns the highest applied schema version, 0 for an empty database.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version')")
+        if cur.fetchone()[0] is None:
+            version = 0
+        else:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            version = cur.fetchone()[0]
+    conn.rollback()
+    return version
+
+
+def pending_migrations(conn):
+    """
+    Returns the (version, description, function) entries not applied yet.
+    """
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def migrate(conn, target=None):
+    """
+    Applies pending migrations up to `target` (default: latest), each in its own transaction.
+
+    Concurrent runs serialize on a lock of schema_version, so every migration
+    is applied exactly once. Returns the versions that were applied.
+    """
+    _ensure_version_table(conn)
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE schema_version IN EXCLUSIVE MODE")
+            cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+            if cur.fetchone() is not None:
+                conn.rollback()
+                continue
+            try:
+                func(cur)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        applied.append(version)
+    return applied
+
+
+def require_current_schema(conn):
+    """
+    Raises RuntimeError when the database still has migrations to apply.
+    """
+    pending = pending_migrations(conn)
+    if pending:
+        raise RuntimeError(
+            f"Database schema is at version {current_version(conn)}, "
+            f"{len(pending)} migration(s) pending; run `python migrations.py` first"
+        )
+
+
+def main():
+    from db_setup import get_connection
+
+    parser = argparse.ArgumentParser(description="Apply or inspect AAS schema migrations.")
+    parser.add_argument("command", nargs="?", choices=["upgrade", "status"], default="upgrade")
+    parser.add_argument("--target", type=int, help="stop after this schema version")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        if args.command == "status":
+            print(f"Schema version: {current_version(conn)}")
+            for version, description, _ in pending_migrations(conn):
+                print(f"  pending {version}: {description}")
+            return 0
+
+        applied = migrate(conn, args.target)
+        for version, description, _ in MIGRATIONS:
+            if version in applied:
+                print(f"Applied {version}: {description}")
+        print(f"Schema version: {current_version(conn)}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+# mir_poller.py
+#
+# Polls MiR robots over their REST API (GET <url>/api/v2.0.0/status) and maps
+# the status documents onto MIR_SUBMODEL_TEMPLATE. All robots share one
+# aiohttp session whose connector keeps each robot's connection alive from
+# poll to poll; every request is bounded by the robot's "timeout" (default
+# MIR_POLL_TIMEOUT), so one unreachable robot only costs its own poll.
+#
+# run-all.py polls the MiR robots that have a "url" in ROBOTS this way. On its
+# own the module measures fleet poll throughput against mir_stub.py, without
+# a database:
+#
+#   python mir_poller.py --robots 500 --latency 0.05 --interval 1 --duration 30
+#   python mir_poller.py --url http://localhost:8090 --robots 500    (stub started separately)
+#
+# Needs aiohttp (pip install aiohttp).
+
+import argparse
+import asyncio
+import sys
+import time
+from functools import partial
+from config import MIR_API_AUTHORIZATION, MIR_POLL_TIMEOUT, MIR_POLL_MAX_CONNECTIONS
+from metrics import robot_poll_seconds
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+STATUS_PATH = "/api/v2.0.0/status"
+
+# MIR_SUBMODEL_TEMPLATE key -> path of the value in a status document
+STATUS_FIELDS = {
+    "mode_text": ("mode_text",),
+    "state_text": ("state_text",),
+    "battery_percentage": ("battery_percentage",),
+    "battery_time_remaining": ("battery_time_remaining",),
+    "velocity": ("velocity", "linear"),
+    "velocityAngular": ("velocity", "angular"),
+    "mission_queue_id": ("mission_queue_id",),
+    "mission_text": ("mission_text",),
+    "moved": ("moved",),
+    "distance_to_next_target": ("distance_to_next_target",),
+    "positionX": ("position", "x"),
+    "positionY": ("position", "y"),
+    "orientation": ("position", "orientation"),
+    "joystick_low_speed_mode_enabled": ("joystick_low_speed_mode_enabled",),
+    "safety_system_muted": ("safety_system_muted",),
+    "unloadedMapChanges": ("unloaded_map_changes",),
+}
+
+
+def require_aiohttp():
+    if aiohttp is None:
+        raise RuntimeError("Polling MiR robots over REST needs aiohttp; install it with `pip install aiohttp`")
+
+
+def status_to_data(status, serial_number, robot_name):
+    """
+    Maps a MiR status document onto a data point for MIR_SUBMODEL_TEMPLATE.
+    The robot is identified by its ROBOTS entry; fields missing from the status are left out.
+    """
+    data = {"serial_number": serial_number, "robot_name": robot_name}
+    for key, path in STATUS_FIELDS.items():
+        value = status
+        for part in path:
+            value = value.get(part) if isinstance(value, dict) else None
+        if value is not None:
+            data[key] = value
+    return data
+
+
+class MirPoller:
+    """
+    Fetches MiR status documents over one shared, keep-alive aiohttp session.
+
+    Use as `async with MirPoller() as poller`, or call open() and close()
+    from the event loop.
+    """
+
+    def __init__(self, authorization=MIR_API_AUTHORIZATION, timeout=MIR_POLL_TIMEOUT,
+                 max_connections=MIR_POLL_MAX_CONNECTIONS):
+        require_aiohttp()
+        self.authorization = authorization
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._session = None
+        self.stats = {"polls": 0, "timeouts": 0, "errors": 0}
+
+    async def open(self):
+        headers = {"Accept": "application/json", "Accept-Language": "en_US"}
+        if self.authorization is not None:
+            headers["Authorization"] = self.authorization
+        # limit_per_host=0: a stub serves the whole fleet from one host
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=0)
+        self._session = aiohttp.ClientSession(connector=connector, headers=headers)
+        return self
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def fetch_status(self, url, timeout=None):
+        """
+        Returns the status document of the robot whose API is at `url`.
+        Raises asyncio.TimeoutError after `timeout` seconds (default: the poller's).
+        """
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._session.get(url.rstrip("/") + STATUS_PATH,
+                                         timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)) as response:
+                response.raise_for_status()
+                status = await response.json(content_type=None)
+            outcome = "ok"
+            self.stats["polls"] += 1
+            return status
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.stats["timeouts"] += 1
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            robot_poll_seconds.observe(time.perf_counter() - started, outcome=outcome)
+
+    async def poll(self, robot):
+        """
+        Fetches a robot (a ROBOTS entry with a "url") and returns its data point.
+        """
+        status = await self.fetch_status(robot["url"], robot.get("timeout"))
+        return status_to_data(status, robot["serial_number"], robot["robot_name"])
+
+    def poll_job(self, robot, process, run_blocking):
+        """
+        Returns a coroutine function for PollScheduler.register that fetches
+        the robot and passes the data point to `process(data=...)`, such as
+        a partial of MiR_Data.process_mir_data. As storing may block,
+        `process` runs through `run_blocking` (PollScheduler.run_blocking).
+        """
+        async def poll():
+            data = await self.poll(robot)
+            await run_blocking(partial(process, data=data))
+        return poll
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    return {f"p{p}": round(values[min(int(len(values) * p / 100), len(values) - 1)] * 1000, 2) for p in (50, 95, 99)}
+
+
+async def measure(robots, interval, duration):
+    """
+    Polls `robots` through a PollScheduler for `duration` seconds without
+    storing anything; returns throughput, failures and latency percentiles.
+    """
+    from scheduler import PollScheduler
+
+    latencies = []
+
+    async def discard(poller, robot):
+        started = time.perf_counter()
+        await poller.poll(robot)
+        latencies.append(time.perf_counter() - started)
+
+    scheduler = PollScheduler()
+    async with MirPoller() as poller:
+        for robot in robots:
+            scheduler.register(robot["serial_number"], partial(discard, poller, robot), interval)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(scheduler.run(), duration)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - started
+
+    return {
+        "robots": len(robots),
+        "polls": poller.stats["polls"],
+        "polls_per_second": round(poller.stats["polls"] / elapsed, 1),
+        "expected_per_second": round(len(robots) / interval, 1),
+        "timeouts": poller.stats["timeouts"],
+        "errors": poller.stats["errors"],
+        "overruns": scheduler.stats["overruns"],
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def main():
+    import json
+    from mir_stub import fleet, start_stub
+
+    parser = argparse.ArgumentParser(description="Measure MiR REST poll throughput against mir_stub.py.")
+    parser.add_argument("--url", help="base URL of a running mir_stub.py (default: start one in-process)")
+    parser.add_argument("--robots", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between polls of each robot")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="in-process stub: seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="in-process stub: +/- seconds of latency")
+    args = parser.parse_args()
+    require_aiohttp()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = start_stub(args.robots, port=0, latency=args.latency, jitter=args.jitter)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        result = asyncio.run(measure(fleet(url, args.robots), args.interval, args.duration))
+    finally:
+        if server is not None:
+            server.shutdown()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# mir_stub.py
+#
+# Local stand-in for a fleet of MiR robots, for testing the REST poller
+# offline. Serves GET /<serial>/api/v2.0.0/status for robots SN-MIR0001,
+# SN-MIR0002, ... with simulated values after a configurable delay, over
+# HTTP/1.1 keep-alive connections:
+#
+#   python mir_stub.py --robots 500 --port 8090 --latency 0.05 --jitter 0.02
+#
+# Robot "SN-MIR0001" then has the url http://localhost:8090/SN-MIR0001 in ROBOTS.
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from MiR_Data import generate_mir_data
+from mir_poller import STATUS_FIELDS, STATUS_PATH
+
+
+def fleet(base_url, count, interval=2.0):
+    """
+    Returns ROBOTS entries for the first `count` robots of a stub at `base_url`.
+    """
+    return [
+        {"type": "mir", "serial_number": f"SN-MIR{i:04d}", "robot_name": f"MiR-{i:04d}",
+         "url": f"{base_url.rstrip('/')}/SN-MIR{i:04d}", "interval": interval}
+        for i in range(1, count + 1)
+    ]
+
+
+def mir_status(serial_number, robot_name):
+    """
+    Returns a simulated status document shaped like the MiR REST API's.
+    """
+    data = generate_mir_data(serial_number, robot_name)
+    status = {"serial_number": serial_number, "robot_name": robot_name, "errors": []}
+    for key, path in STATUS_FIELDS.items():
+        node = status
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = data[key]
+    return status
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of pollers connect at once on startup
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Pollers that time out or stop drop their connections mid-request
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        serial_number, _, path = self.path.split("?", 1)[0].lstrip("/").partition("/")
+        robot_name = server.robots.get(serial_number)
+        if robot_name is None or "/" + path != STATUS_PATH:
+            return self._reply(404, {"error_code": "404", "error_human": "Not found"})
+
+        time.sleep(max(server.latency + random.uniform(-server.jitter, server.jitter), 0))
+        if random.random() < server.failure_rate:
+            return self._reply(503, {"error_code": "503", "error_human": "Simulated failure"})
+        self._reply(200, mir_status(serial_number, robot_name))
+
+    def _reply(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(robots=100, port=8090, latency=0.05, jitter=0.0, failure_rate=0.0, host="127.0.0.1"):
+    """
+    Serves `robots` simulated MiR robots from a background thread; each
+    response takes `latency` +/- `jitter` seconds and fails with 503 at
+    `failure_rate`. Port 0 picks a free port (see server_address). Returns
+    the server; call shutdown() on it to stop.
+    """
+    server = _StubServer((host, port), _StubHandler)
+    server.robots = {entry["serial_number"]: entry["robot_name"] for entry in fleet("", robots)}
+    server.latency = latency
+    server.jitter = jitter
+    server.failure_rate = failure_rate
+    threading.Thread(target=server.serve_forever, name="mir-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve simulated MiR robots over the MiR REST API.")
+    parser.add_argument("--robots", type=int, default=100)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of responses failing with 503")
+    args = parser.parse_args()
+
+    server = start_stub(args.robots, args.port, args.latency, args.jitter, args.failure_rate, args.host)
+    print(f"Serving {args.robots} MiR robots on http://{args.host}:{server.server_address[1]}/SN-MIR0001 ...")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
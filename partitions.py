@@ -0,0 +1,199 @@
+# partitions.py
+#
+# Time-range partitions of the history table and partition-drop retention.
+#
+#   python partitions.py maintain   create upcoming partitions, drop expired ones
+#   python partitions.py list       show the partitions and their ranges
+#
+# Partitions are created HISTORY_PARTITION_PREMAKE intervals ahead of time, so
+# the ingest path never waits on DDL. Expired data goes away by dropping whole
+# partitions instead of DELETE, which leaves nothing behind for vacuum.
+
+import argparse
+import re
+import sys
+import threading
+from datetime import datetime, timedelta
+from config import HISTORY_PARTITION_INTERVAL, HISTORY_PARTITION_PREMAKE, HISTORY_RETENTION_DAYS
+from config import PARTITION_MAINTENANCE_INTERVAL
+from rollups import expire_rollups
+
+PARTITIONED_TABLES = ["submodel_element_history", "submodel_sample_history"]
+
+_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def interval_delta(interval=HISTORY_PARTITION_INTERVAL):
+    if interval == "daily":
+        return timedelta(days=1)
+    if interval == "weekly":
+        return timedelta(weeks=1)
+    raise ValueError(f"Unknown partition interval: {interval!r} (expected 'daily' or 'weekly')")
+
+
+def partition_start(ts, interval=HISTORY_PARTITION_INTERVAL):
+    """
+    Returns the start of the partition slot containing `ts` (midnight, or Monday midnight).
+    """
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "weekly":
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_name(table, start):
+    suffix = start.strftime("%Y%m%d")
+    if start.time() != datetime.min.time():
+        suffix += start.strftime("_%H%M%S")
+    return f"{table}_p{suffix}"
+
+
+def list_partitions(cur, table):
+    """
+    Returns (name, start, end) of the range partitions of `table`, oldest first.
+    """
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = _BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def ensure_partitions(cur, table="submodel_element_history", start=None, end=None, now=None,
+                      interval=HISTORY_PARTITION_INTERVAL, premake=HISTORY_PARTITION_PREMAKE):
+    """
+    Creates the partitions needed to hold rows from `start` (default: now) up to
+    `end` (default: `premake` intervals past now). Slots already covered, also by
+    partitions of a different interval, are left alone. Returns the new names.
+    """
+    now = now or datetime.now()
+    step = interval_delta(interval)
+    slot = partition_start(start or now, interval)
+    end = end or partition_start(now, interval) + step * (premake + 1)
+
+    existing = [(s, e) for _, s, e in list_partitions(cur, table)]
+    created = []
+    while slot < end:
+        for gap_start, gap_end in _uncovered(slot, slot + step, existing):
+            name = partition_name(table, gap_start)
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+                FOR VALUES FROM (%s) TO (%s)
+            """, (gap_start.isoformat(sep=" "), gap_end.isoformat(sep=" ")))
+            existing.append((gap_start, gap_end))
+            created.append(name)
+        slot += step
+    return created
+
+
+def _uncovered(start, end, ranges):
+    """
+    Yields the parts of [start, end) not covered by any of `ranges`.
+    """
+    cursor = start
+    for r_start, r_end in sorted(ranges):
+        if r_end <= cursor or r_start >= end:
+            continue
+        if r_start > cursor:
+            yield cursor, r_start
+        cursor = max(cursor, r_end)
+        if cursor >= end:
+            return
+    if cursor < end:
+        yield cursor, end
+
+
+def drop_expired_partitions(cur, table="submodel_element_history", retention_days=HISTORY_RETENTION_DAYS, now=None):
+    """
+    Drops partitions whose whole range is older than the retention period.
+    Returns the dropped names; a retention of None keeps everything.
+    """
+    if retention_days is None:
+        return []
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    dropped = []
+    for name, _, end in list_partitions(cur, table):
+        if end <= cutoff:
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return dropped
+
+
+def run_maintenance(conn, now=None):
+    """
+    Creates upcoming and drops expired partitions of every partitioned table,
+    and deletes expired rollup rows.
+    """
+    created, dropped = [], []
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            created += ensure_partitions(cur, table, now=now)
+            dropped += drop_expired_partitions(cur, table, now=now)
+        expire_rollups(cur, now=now)
+    conn.commit()
+    return created, dropped
+
+
+def maintenance_thread(stop_event, connection, interval=PARTITION_MAINTENANCE_INTERVAL):
+    """
+    Runs run_maintenance every `interval` seconds until `stop_event` is set.
+    `connection` is a context manager factory such as db_setup.connection.
+    """
+    while True:
+        try:
+            with connection() as conn:
+                created, dropped = run_maintenance(conn)
+            if created or dropped:
+                print(f"Partitions created: {created}, dropped: {dropped}")
+        except Exception as e:
+            print(f"Partition maintenance failed: {e}")
+        if stop_event.wait(interval):
+            break
+
+
+def start_maintenance_thread(connection, interval=PARTITION_MAINTENANCE_INTERVAL):
+    """
+    Starts maintenance_thread in the background; set the returned event to stop it.
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=maintenance_thread, args=(stop_event, connection, interval),
+                              name="partition-maintenance", daemon=True)
+    thread.start()
+    return stop_event, thread
+
+
+def main():
+    from db_setup import get_connection
+
+    parser = argparse.ArgumentParser(description="Maintain the time partitions of the history tables.")
+    parser.add_argument("command", nargs="?", choices=["maintain", "list"], default="maintain")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        if args.command == "list":
+            with conn.cursor() as cur:
+                for table in PARTITIONED_TABLES:
+                    for name, start, end in list_partitions(cur, table):
+                        print(f"{name}: {start} .. {end}")
+            return 0
+
+        created, dropped = run_maintenance(conn)
+        for name in created:
+            print(f"Created {name}")
+        for name in dropped:
+            print(f"Dropped {name}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
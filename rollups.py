@@ -0,0 +1,133 @@
+# rollups.py
+#
+# Per-minute and per-hour rollups of numeric element history (count, min, max,
+# sum, first and last value per element and bucket).
+#
+# store_samples keeps them current: its history INSERT ... RETURNING feeds the
+# rows it actually inserted into an upsert of every rollup table, in the same
+# statement, so replayed samples are not counted twice. history.py answers
+# coarse aggregate and downsampled reads from the coarsest rollup that fits.
+#
+#   python rollups.py rebuild [--from ...] [--until ...]   recompute from raw history
+#   python rollups.py expire                               drop rows past ROLLUP_RETENTION_DAYS
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+from config import ROLLUP_RETENTION_DAYS
+
+# (name, table, date_trunc unit, seconds per bucket), finest first
+ROLLUPS = [
+    ("1m", "history_rollup_1m", "minute", 60),
+    ("1h", "history_rollup_1h", "hour", 3600),
+]
+
+ROLLUP_COLUMNS = "value_count, value_min, value_max, value_sum, value_first, first_at, value_last, last_at"
+
+
+def _upsert(table, unit, source):
+    return f"""
+        INSERT INTO {table} AS r (submodel_element_id, bucket, {ROLLUP_COLUMNS})
+        SELECT submodel_element_id, date_trunc('{unit}', recorded_at), COUNT(*),
+               MIN(value_num), MAX(value_num), SUM(value_num),
+               (ARRAY_AGG(value_num ORDER BY recorded_at))[1], MIN(recorded_at),
+               (ARRAY_AGG(value_num ORDER BY recorded_at DESC))[1], MAX(recorded_at)
+        FROM {source}
+        WHERE value_num IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (submodel_element_id, bucket) DO UPDATE SET
+            value_count = r.value_count + EXCLUDED.value_count,
+            value_min = LEAST(r.value_min, EXCLUDED.value_min),
+            value_max = GREATEST(r.value_max, EXCLUDED.value_max),
+            value_sum = r.value_sum + EXCLUDED.value_sum,
+            value_first = CASE WHEN EXCLUDED.first_at < r.first_at THEN EXCLUDED.value_first ELSE r.value_first END,
+            first_at = LEAST(r.first_at, EXCLUDED.first_at),
+            value_last = CASE WHEN EXCLUDED.last_at >= r.last_at THEN EXCLUDED.value_last ELSE r.value_last END,
+            last_at = GREATEST(r.last_at, EXCLUDED.last_at)
+    """
+
+
+def rollup_ctes(source):
+    """
+    Returns WITH-list entries folding the rows of CTE `source`
+    (submodel_element_id, recorded_at, value_num) into every rollup table;
+    append them right after the CTE that defines `source`.
+    """
+    return "".join(f",\n    rollup_{name} AS ({_upsert(table, unit, source)})" for name, table, unit, _ in ROLLUPS)
+
+
+def rebuild_rollups(cur, source, start, end):
+    """
+    Recomputes the rollups of [start, end), widened to whole hours, from
+    `source`, a FROM item of narrow history rows such as history.HISTORY_ROWS.
+    Works one day per statement; the caller commits.
+    """
+    start = start.replace(minute=0, second=0, microsecond=0)
+    if end.replace(minute=0, second=0, microsecond=0) != end:
+        end = end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    for _, table, _, _ in ROLLUPS:
+        cur.execute(f"DELETE FROM {table} WHERE bucket >= %s AND bucket < %s", (start, end))
+
+    day = start
+    while day < end:
+        day_end = min(day + timedelta(days=1), end)
+        cur.execute(f"""
+            WITH raw AS (
+                SELECT submodel_element_id, recorded_at, value_num FROM {source} AS history
+                WHERE recorded_at >= %s AND recorded_at < %s
+            ){rollup_ctes("raw")}
+            SELECT COUNT(*) FROM raw
+        """, (day, day_end))
+        day = day_end
+
+
+def expire_rollups(cur, retention_days=ROLLUP_RETENTION_DAYS, now=None):
+    """
+    Deletes rollup rows older than the retention period; None keeps everything.
+    Rollups usually outlive the raw history they summarize.
+    """
+    if retention_days is None:
+        return 0
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    deleted = 0
+    for _, table, _, _ in ROLLUPS:
+        cur.execute(f"DELETE FROM {table} WHERE bucket < %s", (cutoff,))
+        deleted += cur.rowcount
+    return deleted
+
+
+def main():
+    from db_setup import get_connection
+    from data_logic import HISTORY_TABLE
+    from history import HISTORY_ROWS, parse_timestamp
+    from partitions import list_partitions
+
+    parser = argparse.ArgumentParser(description="Maintain the history rollup tables.")
+    parser.add_argument("command", choices=["rebuild", "expire"])
+    parser.add_argument("--from", dest="start", type=parse_timestamp, help="ISO 8601 start (default: oldest history)")
+    parser.add_argument("--until", dest="end", type=parse_timestamp, help="ISO 8601 end (default: newest history)")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            if args.command == "expire":
+                print(f"Deleted {expire_rollups(cur)} expired rollup rows")
+            else:
+                partitions = list_partitions(cur, HISTORY_TABLE)
+                if not partitions:
+                    print("No history to roll up")
+                    return 0
+                start = args.start or partitions[0][1]
+                end = args.end or partitions[-1][2]
+                rebuild_rollups(cur, HISTORY_ROWS, start, end)
+                print(f"Rebuilt rollups from {start} to {end}")
+        conn.commit()
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,77 @@
-from MiR_Data import mir_thread
-from KUKA_AAS import kuka_thread
-import threading
-import time
+import asyncio
+from functools import partial
+from MiR_Data import process_mir_data
+from KUKA_AAS import process_kuka_data
+from config import ROBOTS, METRICS_PORT, INGEST_SPOOL_DIR
+from data_logic import BatchWriter
+from db_setup import connection, close_pool
+from migrations import require_current_schema
+from mir_poller import MirPoller
+from partitions import start_maintenance_thread
+from scheduler import PollScheduler
+from spool import Spool, SpoolDrainer
+import metrics
 
-stop_threads = False
+ROBOT_PROCESSORS = {
+    "mir": process_mir_data,
+    "kuka": process_kuka_data,
+}
+
+async def main(writer, spool=None):
+    scheduler = PollScheduler()
+    # MiR robots with a "url" are fetched over their REST API on the event loop
+    poller = None
+    if any(robot["type"] == "mir" and robot.get("url") for robot in ROBOTS):
+        poller = await MirPoller().open()
+    for robot in ROBOTS:
+        process = partial(ROBOT_PROCESSORS[robot["type"]], writer, robot["serial_number"], robot["robot_name"],
+                          spool=spool)
+        if robot["type"] == "mir" and robot.get("url"):
+            process = poller.poll_job(robot, process, scheduler.run_blocking)
+        scheduler.register(robot["serial_number"], process, robot.get("interval", 2.0))
+    # Cancelled by Ctrl+C; run() then cancels every robot task and waits for running polls
+    try:
+        await scheduler.run()
+    finally:
+        if poller is not None:
+            await poller.close()
 
 if __name__ == "__main__":
-    mir = threading.Thread(target=mir_thread)
-    kuka = threading.Thread(target=kuka_thread)
+    with connection() as conn:
+        require_current_schema(conn)
+
+    # Keeps history partitions created ahead of ingest and drops expired ones
+    maintenance_stop, maintenance = start_maintenance_thread(connection)
+
+    # Ingest timings and statement counts for Prometheus
+    metrics_server = None
+    if metrics.enabled and METRICS_PORT is not None:
+        metrics_server = metrics.start_http_server(METRICS_PORT)
 
-    mir.start()
-    kuka.start()
+    # Polls only append to the local spool, so a slow or restarting database
+    # delays the drainer but not the sampling; without a spool all robots share
+    # one writer, so a flush carries samples from the whole fleet
+    writer = spool = drainer = None
+    if INGEST_SPOOL_DIR is not None:
+        spool = Spool(INGEST_SPOOL_DIR)
+        drainer = SpoolDrainer(spool, connection).start()
+    else:
+        writer = BatchWriter(connection)
 
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(main(writer, spool))
     except KeyboardInterrupt:
-        stop_threads = True
-        mir.join()
-        kuka.join()
-        print("\nStopped MiR and KUKA data generation threads safely.")
+        pass
+    finally:
+        if spool is not None:
+            # The drainer reads the spool until its current round is done
+            drainer.stop()
+            spool.close()
+        else:
+            writer.close()
+        maintenance_stop.set()
+        maintenance.join()
+        close_pool()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        print(f"\nStopped polling {len(ROBOTS)} robots safely.")
@@ -0,0 +1,100 @@
+# scheduler.py
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import SCHEDULER_MAX_CONCURRENCY, SCHEDULER_MAX_ASYNC_CONCURRENCY
+
+
+class PollScheduler:
+    """
+    Polls any number of robots from one asyncio event loop.
+
+    Each registered robot is a task that calls its `poll` function every
+    `interval` seconds. Blocking poll functions (data collection plus database
+    writes through psycopg2) run on a thread pool, so no more than
+    `max_concurrency` polls, and therefore database connections, are busy at
+    once. Coroutine functions (network polls such as mir_poller's) are awaited
+    directly, up to `max_async_concurrency` at once, and hand their blocking
+    work to run_blocking(), which shares the thread pool's limit.
+    """
+
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY, max_async_concurrency=SCHEDULER_MAX_ASYNC_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.max_async_concurrency = max_async_concurrency
+        self._robots = []
+        self._tasks = []
+        self._executor = None
+        self._semaphore = None
+        self._async_semaphore = None
+        self.stats = {"polls": 0, "failures": 0, "overruns": 0}
+
+    def register(self, name, poll, interval=2.0):
+        """
+        Adds a robot; `poll` is called without arguments every `interval` seconds.
+        """
+        self._robots.append((name, poll, interval))
+
+    async def run(self):
+        """
+        Polls all registered robots until cancelled.
+        """
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._async_semaphore = asyncio.Semaphore(self.max_async_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="poll")
+        count = len(self._robots)
+        # Spread the first polls over each robot's interval instead of starting them all at once
+        self._tasks = [
+            asyncio.create_task(self._robot_loop(name, poll, interval, interval * i / count), name=f"poll-{name}")
+            for i, (name, poll, interval) in enumerate(self._robots)
+        ]
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Cancels the robot tasks and waits for polls already running on the thread pool.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+
+    async def run_blocking(self, func):
+        """
+        Runs a blocking function on the scheduler's thread pool, under its concurrency limit.
+        """
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func)
+
+    async def _robot_loop(self, name, poll, interval, initial_delay):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(initial_delay)
+        next_run = loop.time()
+        while True:
+            started = time.monotonic()
+            try:
+                if inspect.iscoroutinefunction(poll):
+                    async with self._async_semaphore:
+                        await poll()
+                else:
+                    await self.run_blocking(poll)
+                self.stats["polls"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"Polling {name} failed after {time.monotonic() - started:.2f}s: {e}")
+
+            # Keep a fixed rate; a poll that overran its slot skips ahead instead of bursting
+            next_run += interval
+            if next_run < loop.time():
+                self.stats["overruns"] += 1
+                next_run = loop.time()
+            await asyncio.sleep(next_run - loop.time())
@@ -0,0 +1,352 @@
+# spool.py
+#
+# Local write-ahead spool between the robot pollers and the database. Pollers
+# append samples to segment files on disk, which only costs a write(); a
+# SpoolDrainer thread replays them into Postgres in batches and advances a
+# checkpoint once a batch is committed.
+#
+# Delivery is at-least-once: a batch whose commit succeeded but whose
+# checkpoint was not written yet is replayed after a restart. Every spooled
+# sample carries a sample_id, from which store_samples derives its history
+# row IDs, so a replay adds no duplicate history.
+#
+# Layout of the spool directory:
+#   000000000001.log ...   segments of JSON lines, appended in order
+#   checkpoint             "<segment> <byte offset>" of the first undrained sample
+
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from config import INGEST_SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_FSYNC_INTERVAL
+from config import SPOOL_DRAIN_MAX_SAMPLES, SPOOL_DRAIN_INTERVAL
+from ingest import ROBOT_TYPES, robot_type_errors, store_batch
+import metrics
+
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint"
+
+
+class Spool:
+    """
+    Append-only, segmented sample log in `directory`.
+
+    append() writes one JSON line to the active segment; a background thread
+    fsyncs the segment every `fsync_interval` seconds, so a crash loses at
+    most that much. Segments roll over at `segment_bytes`. When the undrained
+    segments exceed `max_bytes`, the oldest are dropped, like BatchWriter
+    drops its oldest samples beyond max_pending.
+    """
+
+    def __init__(self, directory=INGEST_SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES,
+                 fsync_interval=SPOOL_FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._stats = {"appended": 0, "dropped": 0, "fsyncs": 0}
+        self._dirty = False
+        self._closed = threading.Event()
+
+        # Always start a new segment; a torn last line of an old one is skipped when read
+        segments = self.segments()
+        self._open_segment((segments[-1] if segments else 0) + 1)
+
+        self._sync_thread = threading.Thread(target=self._sync_loop, name="spool-fsync", daemon=True)
+        self._sync_thread.start()
+
+    def segments(self):
+        """
+        Returns the sequence numbers of the segments on disk, oldest first.
+        """
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    def append(self, robot_type, data, recorded_at=None):
+        """
+        Spools one data point of a robot type in ROBOT_TYPES, stamped now unless `recorded_at` is given.
+        """
+        record = {
+            "sample_id": uuid.uuid4().hex,
+            "type": robot_type,
+            "recorded_at": (recorded_at or datetime.now()).isoformat(),
+            "data": data,
+        }
+        line = (json.dumps(record, default=str) + "\n").encode()
+        with self._lock:
+            if self._offset + len(line) > self.segment_bytes and self._offset > 0:
+                self._roll_over()
+            os.write(self._fd, line)
+            self._offset += len(line)
+            self._dirty = True
+            self._stats["appended"] += 1
+
+    def sync(self):
+        """
+        Flushes appended samples to disk.
+        """
+        with self._lock:
+            if self._dirty:
+                os.fsync(self._fd)
+                self._dirty = False
+                self._stats["fsyncs"] += 1
+
+    def active_position(self):
+        """
+        Returns (segment, offset) of the end of the spool.
+        """
+        with self._lock:
+            return self._seq, self._offset
+
+    def read_checkpoint(self):
+        """
+        Returns (segment, offset) of the first undrained sample.
+        """
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            segments = self.segments()
+            return (segments[0] if segments else 1), 0
+
+    def read(self, position, max_samples):
+        """
+        Reads up to `max_samples` spooled records from `position`.
+
+        Returns (records, next position); only complete lines are returned,
+        and unparseable ones are skipped.
+        """
+        active_seq, active_offset = self.active_position()
+        seq, offset = position
+        records = []
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            if segment > seq:
+                seq, offset = segment, 0
+            end = active_offset if segment == active_seq else None
+            try:
+                with open(self.segment_path(segment), "rb") as f:
+                    f.seek(offset)
+                    while len(records) < max_samples and (end is None or offset < end):
+                        line = f.readline()
+                        if not line.endswith(b"\n"):
+                            break
+                        offset += len(line)
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            print(f"Skipping corrupt spool record in segment {segment} at offset {offset - len(line)}")
+            except FileNotFoundError:
+                continue
+            if len(records) >= max_samples or segment == active_seq:
+                break
+        return records, (seq, offset)
+
+    def commit(self, position):
+        """
+        Marks everything before `position` as drained and deletes the fully drained segments.
+        """
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{position[0]} {position[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        for segment in self.segments():
+            if segment >= position[0]:
+                break
+            os.remove(self.segment_path(segment))
+
+    def depth_bytes(self, position=None):
+        """
+        Returns the bytes spooled but not drained yet.
+        """
+        seq, offset = position or self.read_checkpoint()
+        total = 0
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            try:
+                total += os.path.getsize(self.segment_path(segment))
+            except FileNotFoundError:
+                continue
+            if segment == seq:
+                total -= offset
+        return max(total, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["segments"] = len(self.segments())
+        stats["depth_bytes"] = self.depth_bytes()
+        return stats
+
+    def close(self):
+        """
+        Stops the fsync thread and flushes the active segment.
+        """
+        self._closed.set()
+        self._sync_thread.join()
+        self.sync()
+        with self._lock:
+            os.close(self._fd)
+
+    def _open_segment(self, seq):
+        self._seq = seq
+        self._fd = os.open(self.segment_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._offset = os.fstat(self._fd).st_size
+
+    def _roll_over(self):
+        # Called with the lock held
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._dirty = False
+        self._open_segment(self._seq + 1)
+        self._enforce_max_bytes()
+
+    def _enforce_max_bytes(self):
+        segments = [s for s in self.segments() if s < self._seq]
+        sizes = {s: os.path.getsize(self.segment_path(s)) for s in segments}
+        total = sum(sizes.values())
+        for segment in segments:
+            if total <= self.max_bytes:
+                break
+            with open(self.segment_path(segment), "rb") as f:
+                self._stats["dropped"] += sum(1 for _ in f)
+            os.remove(self.segment_path(segment))
+            total -= sizes[segment]
+            print(f"Spool over {self.max_bytes} bytes, dropped undrained segment {segment}")
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"Spool fsync failed: {e}")
+
+
+class SpoolDrainer:
+    """
+    Background thread that replays a Spool into the database.
+
+    Each round reads up to `max_samples` records after the checkpoint, stores
+    them with ingest.store_batch in one transaction and then advances the
+    checkpoint. A failed round is retried from the same checkpoint after
+    `interval` seconds. `connection` is a context manager factory such as
+    db_setup.connection.
+    """
+
+    def __init__(self, spool, connection, max_samples=SPOOL_DRAIN_MAX_SAMPLES, interval=SPOOL_DRAIN_INTERVAL):
+        self.spool = spool
+        self._connection = connection
+        self.max_samples = max_samples
+        self.interval = interval
+        self._position = spool.read_checkpoint()
+        self._ensured = set()
+        # (checkpoint, recorded_at) of the first sample after the checkpoint
+        self._oldest_pending = None
+        self._stats = {"drained": 0, "failures": 0, "skipped": 0}
+        self._stopped = threading.Event()
+        self._thread = None
+        metrics.register_collector(self._metrics)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops draining after the current round; what is left stays spooled for the next start.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def drain_once(self):
+        """
+        Stores one batch from the spool; returns the number of records it covered.
+        """
+        records, position = self.spool.read(self._position, self.max_samples)
+        if position == self._position:
+            return 0
+
+        batch = []
+        for record in records:
+            robot_type = ROBOT_TYPES.get(record.get("type"))
+            if robot_type is None or not isinstance(record.get("data"), dict):
+                self._stats["skipped"] += 1
+                continue
+            template, ensure_structure = robot_type
+            data = dict(record["data"], sample_id=record["sample_id"])
+            batch.append((record["type"], (data, template, datetime.fromisoformat(record["recorded_at"]),
+                                           ensure_structure)))
+
+        if batch:
+            with metrics.stage("drain"):
+                with self._connection() as conn:
+                    # Records of a serial number provisioned as another robot type would fail every retry
+                    errors = robot_type_errors(conn, [(robot_type, entry[0]["serial_number"])
+                                                      for robot_type, entry in batch])
+                    self._stats["skipped"] += sum(error is not None for error in errors)
+                    batch = [entry for (_, entry), error in zip(batch, errors) if error is None]
+                    if batch:
+                        store_batch(conn, batch, self._ensured)
+
+        self.spool.commit(position)
+        self._position = position
+        self._stats["drained"] += len(batch)
+        return len(records)
+
+    def lag_seconds(self):
+        """
+        Age of the oldest sample still waiting to be stored, 0 when caught up.
+
+        That is the first sample after the checkpoint; it is read from the
+        spool once and kept until the checkpoint moves past it.
+        """
+        position = self._position
+        pending = self._oldest_pending
+        if pending is None or pending[0] != position:
+            records, _ = self.spool.read(position, 1)
+            try:
+                pending = (position, datetime.fromisoformat(records[0]["recorded_at"]))
+            except (IndexError, KeyError, TypeError, ValueError):
+                # Caught up, or an unreadable record the next round skips
+                return 0.0
+            self._oldest_pending = pending
+        return max((datetime.now() - pending[1]).total_seconds(), 0.0)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                drained = self.drain_once()
+            except Exception as e:
+                self._stats["failures"] += 1
+                print(f"Spool drain failed, retrying from the checkpoint: {e}")
+                drained = 0
+            # Keep going while there is a backlog; otherwise wait for new samples
+            if drained < self.max_samples:
+                self._stopped.wait(self.interval)
+
+    def _metrics(self):
+        stats = self.spool.stats()
+        return [
+            ("aas_spool_depth_bytes", "gauge", "Bytes spooled but not stored yet.", stats["depth_bytes"]),
+            ("aas_spool_segments", "gauge", "Segment files in the spool.", stats["segments"]),
+            ("aas_spool_lag_seconds", "gauge", "Age of the oldest sample not stored yet.", self.lag_seconds()),
+            ("aas_spool_appended_total", "counter", "Samples appended to the spool.", stats["appended"]),
+            ("aas_spool_dropped_total", "counter", "Samples dropped because the spool was full.", stats["dropped"]),
+            ("aas_spool_fsyncs_total", "counter", "fsync calls on spool segments.", stats["fsyncs"]),
+            ("aas_spool_drained_total", "counter", "Spooled samples stored in the database.", self._stats["drained"]),
+            ("aas_spool_drain_failures_total", "counter", "Failed drain rounds.", self._stats["failures"]),
+        ]